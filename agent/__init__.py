@@ -1,7 +1,7 @@
 """LinguaHome Agent Module"""
 
-from .loop import AgentLoop
+from .loop import AgentLoop, AgentSession
 from .memory import MemoryStore
 from .context import ContextBuilder
 
-__all__ = ["AgentLoop", "MemoryStore", "ContextBuilder"]
+__all__ = ["AgentLoop", "AgentSession", "MemoryStore", "ContextBuilder"]
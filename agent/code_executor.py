@@ -4,22 +4,18 @@ LinguaHome Code Executor
 Safely executes LLM-generated Python code for smart home control.
 """
 
-import sys
 import io
+import re
+import queue
+import threading
+import ast
+import marshal
+import functools
 import traceback
-from typing import Tuple, Optional
+from types import CodeType, MappingProxyType
+from typing import List, Tuple, Optional, TextIO
 from contextlib import redirect_stdout, redirect_stderr
-import signal
-from pathlib import Path
-
-
-class TimeoutError(Exception):
-    """Code execution timeout."""
-    pass
-
-
-def timeout_handler(signum, frame):
-    raise TimeoutError("Code execution timed out")
+import multiprocessing
 
 
 # Whitelisted modules for safe execution
@@ -43,108 +39,354 @@ ALLOWED_MODULES = {
     "itertools",
 }
 
-# Forbidden patterns in generated code
-FORBIDDEN_PATTERNS = [
-    "import os",
-    "import subprocess",
-    "import shutil",
-    "import socket",
-    "import urllib",
-    "import requests",
+# Safe builtins only (read-only so generated code can't alter them for later runs)
+_BUILTINS = MappingProxyType({
+    "print": print,
+    "len": len,
+    "range": range,
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": bool,
+    "list": list,
+    "dict": dict,
+    "tuple": tuple,
+    "set": set,
+    "sum": sum,
+    "min": min,
+    "max": max,
+    "abs": abs,
+    "round": round,
+    "sorted": sorted,
+    "enumerate": enumerate,
+    "zip": zip,
+    "map": map,
+    "filter": filter,
+    "any": any,
+    "all": all,
+    "isinstance": isinstance,
+    "type": type,
+    "True": True,
+    "False": False,
+    "None": None,
+})
+
+# Names generated code may not reference (calls or otherwise)
+FORBIDDEN_NAMES = frozenset({
     "__import__",
-    "exec(",
-    "eval(",
-    "open(",
-    "file(",
-    "compile(",
-    "globals(",
-    "locals(",
-    "vars(",
-    "delattr(",
-    "setattr(",
-    "getattr(",
-]
+    "__builtins__",
+    "exec",
+    "eval",
+    "open",
+    "file",
+    "compile",
+    "globals",
+    "locals",
+    "vars",
+    "delattr",
+    "setattr",
+    "getattr",
+    "input",
+    "breakpoint",
+})
 
 
-class CodeExecutor:
+class _Violation(Exception):
+    """Raised by _SecurityVisitor on the first unsafe node."""
+
+
+class _SecurityVisitor(ast.NodeVisitor):
     """
-    Executes LLM-generated Python code in a controlled environment.
+    Checks a parsed module for unsafe constructs.
+    
+    Unlike a substring scan, string literals and comments that merely
+    mention e.g. "open(" are not rejected.
     """
     
-    def __init__(self, timeout: int = 30, safe_mode: bool = True):
-        self.timeout = timeout
-        self.safe_mode = safe_mode
-        self._setup_namespace()
-    
-    def _setup_namespace(self) -> dict:
-        """Create the execution namespace with allowed imports."""
-        namespace = {
-            "__builtins__": {
-                # Safe builtins only
-                "print": print,
-                "len": len,
-                "range": range,
-                "str": str,
-                "int": int,
-                "float": float,
-                "bool": bool,
-                "list": list,
-                "dict": dict,
-                "tuple": tuple,
-                "set": set,
-                "sum": sum,
-                "min": min,
-                "max": max,
-                "abs": abs,
-                "round": round,
-                "sorted": sorted,
-                "enumerate": enumerate,
-                "zip": zip,
-                "map": map,
-                "filter": filter,
-                "any": any,
-                "all": all,
-                "isinstance": isinstance,
-                "type": type,
-                "True": True,
-                "False": False,
-                "None": None,
-            }
-        }
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            if alias.name not in ALLOWED_MODULES:
+                raise _Violation(f"Forbidden import: {alias.name}")
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        if node.level or node.module not in ALLOWED_MODULES:
+            raise _Violation(f"Forbidden import: {'.' * node.level}{node.module or ''}")
+    
+    def visit_Name(self, node: ast.Name) -> None:
+        if node.id in FORBIDDEN_NAMES:
+            raise _Violation(f"Forbidden name: {node.id}")
+    
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        # Dunder attributes (__class__, __globals__, ...) are sandbox escapes
+        if node.attr.startswith("__") and node.attr.endswith("__"):
+            raise _Violation(f"Forbidden attribute: {node.attr}")
+        self.generic_visit(node)
+
+
+# Source text that could contain something _SecurityVisitor rejects: an
+# import, a forbidden name or a double underscore. ASCII code without any
+# match skips the AST walk (non-ASCII identifiers are NFKC-normalized by
+# the parser, so they always get the full check).
+_SUSPECT_RE = re.compile(
+    r"\bimport\b|__|\b(?:" + "|".join(map(re.escape, sorted(FORBIDDEN_NAMES))) + r")\b"
+)
+
+# The visitor holds no state, so one instance serves every check
+_SECURITY_VISITOR = _SecurityVisitor()
+
+
+def _check_tree(tree: ast.AST) -> Optional[str]:
+    """Return the first security violation in a parsed module, if any."""
+    try:
+        _SECURITY_VISITOR.visit(tree)
+    except _Violation as e:
+        return str(e)
+    return None
+
+
+# Fenced blocks as (language tag, body); matching whole blocks keeps a closing
+# fence from being read as the opening of the next one
+_CODE_BLOCK_RE = re.compile(r"```([\w+-]*)[^\n]*\n(.*?)```", re.DOTALL)
+_PYTHON_FENCE = "```python\n"
+
+
+@functools.lru_cache(maxsize=256)
+def _parse(code: str) -> ast.Module:
+    """Parse generated code, caching the tree for repeated snippets."""
+    return ast.parse(code, "<generated>")
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(code: str) -> CodeType:
+    """Compile generated code from its cached tree, caching the code object."""
+    return compile(_parse(code), "<generated>", "exec")
+
+
+@functools.lru_cache(maxsize=512)
+def _validate(code: str) -> Tuple[bool, Optional[str]]:
+    """Check generated code for safety; the verdict is cached per source text."""
+    # Parse once; the same tree is checked and then compiled
+    try:
+        tree = _parse(code)
+    except SyntaxError as e:
+        return False, f"Syntax error: {e}"
+    
+    if not code.isascii() or _SUSPECT_RE.search(code):
+        error = _check_tree(tree)
+        if error:
+            return False, error
+    
+    # Compiler-level checks (e.g. 'return' outside function)
+    try:
+        _compile(code)
+    except SyntaxError as e:
+        return False, f"Syntax error: {e}"
+    
+    return True, None
+
+
+def _build_template_namespace() -> Tuple[dict, bool]:
+    """
+    Create the template execution namespace with allowed imports.
+    
+    Returns:
+        (namespace, using_mock)
+    """
+    namespace = {"__builtins__": _BUILTINS}
+    
+    # Try to import real rh_sensors, fallback to mock
+    try:
+        from rh_sensors.db.access import Sensors
+        from rh_sensors.homecentre_actuators import ZWaveHomeActuator
+        from rh_sensors.homecentre_sensors import ZWaveHomeSensor
+        from rh_sensors.db.resolver import StateResolver
         
-        # Try to import real rh_sensors, fallback to mock
+        namespace["Sensors"] = Sensors
+        namespace["ZWaveHomeActuator"] = ZWaveHomeActuator
+        namespace["ZWaveHomeSensor"] = ZWaveHomeSensor
+        namespace["StateResolver"] = StateResolver
+        using_mock = False
+    except (ImportError, ModuleNotFoundError) as e:
+        # Use mock sensors instead
         try:
-            from rh_sensors.db.access import Sensors
-            from rh_sensors.homecentre_actuators import ZWaveHomeActuator
-            from rh_sensors.homecentre_sensors import ZWaveHomeSensor
-            from rh_sensors.db.resolver import StateResolver
-            
+            from mock_sensors import Sensors, ZWaveHomeActuator, ZWaveHomeSensor
             namespace["Sensors"] = Sensors
             namespace["ZWaveHomeActuator"] = ZWaveHomeActuator
             namespace["ZWaveHomeSensor"] = ZWaveHomeSensor
-            namespace["StateResolver"] = StateResolver
-            self._using_mock = False
-        except (ImportError, ModuleNotFoundError) as e:
-            # Use mock sensors instead
-            try:
-                from mock_sensors import Sensors, ZWaveHomeActuator, ZWaveHomeSensor
-                namespace["Sensors"] = Sensors
-                namespace["ZWaveHomeActuator"] = ZWaveHomeActuator
-                namespace["ZWaveHomeSensor"] = ZWaveHomeSensor
-                self._using_mock = True
-            except ImportError:
-                print(f"Warning: Could not import sensors (neither real nor mock): {e}")
-                self._using_mock = True
-        
-        # Import datetime for convenience
-        from datetime import datetime, timedelta
-        namespace["datetime"] = datetime
-        namespace["timedelta"] = timedelta
-        
-        import json
-        namespace["json"] = json
+        except ImportError:
+            print(f"Warning: Could not import sensors (neither real nor mock): {e}")
+        using_mock = True
+    
+    # Import datetime for convenience
+    from datetime import datetime, timedelta
+    namespace["datetime"] = datetime
+    namespace["timedelta"] = timedelta
+    
+    import json
+    namespace["json"] = json
+    
+    return namespace, using_mock
+
+
+# Workers start from a forkserver (spawn where there is none): forking this
+# process directly is unsafe once the bots' threads are running
+_mp = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+if _mp.get_start_method() == "forkserver":
+    # Imported once in the server and shared by every worker forked from it
+    _mp.set_forkserver_preload([__name__, "mock_sensors", "rh_sensors.db.access"])
+
+
+# Template namespace of the current worker process, built once by _init_worker
+_worker_ns: Optional[dict] = None
+
+
+def _init_worker() -> None:
+    """Build the execution namespace once per worker process."""
+    global _worker_ns
+    _worker_ns, _ = _build_template_namespace()
+
+
+def _worker_main(conn) -> None:
+    """Worker process loop: run each (code_bytes, max_stdout, max_stderr) sent over `conn`."""
+    _init_worker()
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+        conn.send(_run_in_worker(*args))
+
+
+class _Worker:
+    """One execution process and the parent's end of its pipe."""
+    
+    __slots__ = ("process", "conn")
+    
+    def __init__(self):
+        self.conn, child_conn = _mp.Pipe()
+        self.process = _mp.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+    
+    def kill(self) -> None:
+        """Stop the process, even if it is stuck running code."""
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+
+class _CappedWriter(io.TextIOBase):
+    """Text sink that keeps at most `limit` characters and drops the rest."""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._parts = []
+        self._size = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, s: str) -> int:
+        room = self.limit - self._size
+        if room > 0:
+            part = s if len(s) <= room else s[:room]
+            self._parts.append(part)
+            self._size += len(part)
+        return len(s)
+    
+    def getvalue(self) -> str:
+        return "".join(self._parts)
+
+
+def _run_in_worker(code_bytes: bytes, max_stdout: int, max_stderr: int) -> Tuple[bool, str, str]:
+    """
+    Execute a marshalled code object in a worker process.
+    
+    Output beyond the caps is discarded as it is written, so runaway
+    prints neither grow the worker nor get sent back to the parent.
+    
+    Returns:
+        (success, stdout, stderr)
+    """
+    code = marshal.loads(code_bytes)
+    
+    # Fresh namespace so user code mutations don't leak between runs
+    namespace = dict(_worker_ns)
+    
+    # Capture stdout/stderr
+    stdout_capture = _CappedWriter(max_stdout)
+    stderr_capture = _CappedWriter(max_stderr)
+    
+    try:
+        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
+            exec(code, namespace)
+        return True, stdout_capture.getvalue(), stderr_capture.getvalue()
+    except Exception:
+        # Keep the end of the traceback, where the error itself is
+        return False, stdout_capture.getvalue(), traceback.format_exc()[-max_stderr:]
+
+
+class CodeExecutor:
+    """
+    Executes LLM-generated Python code in a controlled environment.
+    
+    Code runs in pre-warmed worker processes, so executions from different
+    threads or users run in parallel, and a timed-out execution (including
+    one stuck inside a C extension) can be killed. Each execution has a
+    worker to itself, so a timeout kills and replaces only that worker.
+    """
+    
+    def __init__(
+        self,
+        timeout: int = 30,
+        safe_mode: bool = True,
+        processes: int = 2,
+        max_stdout: int = 4096,
+        max_stderr: int = 1024,
+    ):
+        self.timeout = timeout
+        self.safe_mode = safe_mode
+        self.processes = processes
+        self.max_stdout = max_stdout
+        self.max_stderr = max_stderr
         
-        return namespace
+        # Idle workers are handed out to one execution at a time; the lock
+        # guards the list of all workers against concurrent replacement
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = [_Worker() for _ in range(processes)]
+        self._idle: "queue.SimpleQueue[Optional[_Worker]]" = queue.SimpleQueue()
+        for worker in self._workers:
+            self._idle.put(worker)
+    
+    def _replace(self, worker: _Worker) -> _Worker:
+        """Kill a worker and start a fresh one in its place."""
+        worker.kill()
+        fresh = _Worker()
+        with self._lock:
+            if not self._closed:
+                self._workers[self._workers.index(worker)] = fresh
+                return fresh
+        # Closed meanwhile; the fresh worker is not wanted
+        fresh.kill()
+        return fresh
+    
+    def close(self) -> None:
+        """Shut down the worker processes; later executions raise RuntimeError."""
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        # Wake any execution waiting for an idle worker
+        self._idle.put(None)
+        for worker in workers:
+            worker.kill()
     
     def validate_code(self, code: str) -> Tuple[bool, Optional[str]]:
         """
@@ -155,26 +397,21 @@ class CodeExecutor:
         """
         if not self.safe_mode:
             return True, None
-        
-        # Check for forbidden patterns
-        for pattern in FORBIDDEN_PATTERNS:
-            if pattern in code:
-                return False, f"Forbidden pattern detected: {pattern}"
-        
-        # Basic syntax check
-        try:
-            compile(code, "<generated>", "exec")
-        except SyntaxError as e:
-            return False, f"Syntax error: {e}"
-        
-        return True, None
+        return _validate(code)
+    
+    def validate_code_batch(self, codes: List[str]) -> List[Tuple[bool, Optional[str]]]:
+        """Validate several sources, returning one (is_safe, error_message) each."""
+        if not self.safe_mode:
+            return [(True, None)] * len(codes)
+        return [_validate(code) for code in codes]
     
-    def execute(self, code: str) -> Tuple[bool, str, str]:
+    def execute(self, code: str, stdout: Optional[TextIO] = None) -> Tuple[bool, str, str]:
         """
         Execute the given Python code.
         
         Args:
             code: Python code to execute
+            stdout: Optional stream the captured output is also written to
             
         Returns:
             (success, stdout, stderr)
@@ -184,59 +421,85 @@ class CodeExecutor:
         if not is_safe:
             return False, "", f"Code validation failed: {error}"
         
-        # Capture stdout/stderr
-        stdout_capture = io.StringIO()
-        stderr_capture = io.StringIO()
+        # Reuse the code object compiled during validation
+        try:
+            code_obj = _compile(code)
+        except SyntaxError:
+            return False, "", traceback.format_exc()
+        return self.execute_compiled(code_obj, stdout)
+    
+    def execute_compiled(self, code_obj: CodeType, stdout: Optional[TextIO] = None) -> Tuple[bool, str, str]:
+        """
+        Execute an already compiled code object, skipping parsing and validation.
         
-        # Create fresh namespace
-        namespace = self._setup_namespace()
+        The caller is responsible for having validated its source with
+        validate_code() first. Output captured in the worker is also written
+        to `stdout` when given.
         
+        Returns:
+            (success, stdout, stderr)
+        """
+        # Workers receive the code marshalled so they skip the parser entirely
+        code_bytes = marshal.dumps(code_obj)
+        
+        # The timeout counts from when a worker picks the code up
+        worker = self._idle.get()
+        if self._closed:
+            # Pass the wake-up on to the next waiter
+            self._idle.put(worker)
+            raise RuntimeError("CodeExecutor is closed")
         try:
-            # Set timeout (Unix only)
-            if hasattr(signal, 'SIGALRM'):
-                signal.signal(signal.SIGALRM, timeout_handler)
-                signal.alarm(self.timeout)
-            
-            # Execute with captured output
-            with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-                exec(code, namespace)
-            
-            # Clear alarm
-            if hasattr(signal, 'SIGALRM'):
-                signal.alarm(0)
-            
-            stdout = stdout_capture.getvalue()
-            stderr = stderr_capture.getvalue()
-            
-            return True, stdout, stderr
-            
-        except TimeoutError:
-            return False, "", f"Execution timed out after {self.timeout} seconds"
-        except Exception as e:
-            if hasattr(signal, 'SIGALRM'):
-                signal.alarm(0)
-            error_msg = traceback.format_exc()
-            return False, stdout_capture.getvalue(), error_msg
+            worker.conn.send((code_bytes, self.max_stdout, self.max_stderr))
+            if not worker.conn.poll(self.timeout):
+                # The worker is still running the code; replace just that worker
+                worker = self._replace(worker)
+                return False, "", f"Execution timed out after {self.timeout} seconds"
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            # The worker process died mid-run
+            worker = self._replace(worker)
+            return False, "", "Execution failed: worker process exited"
+        finally:
+            self._idle.put(worker)
+        
+        if stdout is not None and result[1]:
+            stdout.write(result[1])
+        return result
     
     def extract_code_from_response(self, llm_response: str) -> Optional[str]:
         """
         Extract Python code from LLM response.
-        Handles ```python ... ``` blocks.
+        Prefers a ```python block anywhere in the response, falling back
+        to the first block without a language tag.
         """
-        # Look for ```python ... ``` blocks
-        if "```python" in llm_response:
-            start = llm_response.find("```python") + len("```python")
-            end = llm_response.find("```", start)
-            if end > start:
-                return llm_response[start:end].strip()
+        # Fast path for the usual "```python\n" fence: plain str.find, no regex
+        start = llm_response.find(_PYTHON_FENCE)
+        if start >= 0:
+            body = start + len(_PYTHON_FENCE)
+            end = llm_response.find("```", body)
+            if end >= 0:
+                return llm_response[body:end].strip()
         
-        # Look for ``` ... ``` blocks (generic)
-        if "```" in llm_response:
-            parts = llm_response.split("```")
-            if len(parts) >= 3:
-                return parts[1].strip()
-        
-        return None
+        plain = None
+        for match in _CODE_BLOCK_RE.finditer(llm_response):
+            language = match.group(1).lower()
+            if language in ("python", "py"):
+                return match.group(2).strip()
+            if not language and plain is None:
+                plain = match.group(2).strip()
+        return plain
+
+
+def preload() -> None:
+    """
+    Import the sensor modules that executed code uses, in this process.
+    
+    Under a pre-forking server, forked app workers then share this
+    read-only data copy-on-write instead of each loading it. Execution
+    workers start from the forkserver instead, which preloads the same
+    modules once for all of them.
+    """
+    _build_template_namespace()
 
 
 # Singleton instance
@@ -4,139 +4,95 @@ LinguaHome Context Builder
 Builds the system prompt and context for LLM code generation.
 """
 
+import functools
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
-from .memory import MemoryStore
-
-
-# Core system prompt for LinguaHome
-SYSTEM_PROMPT = """# LinguaHome Smart Home Assistant
-
-You are LinguaHome, an AI assistant that controls a smart home by generating Python code.
-
-## Your Capabilities
-1. **Query sensors**: Read temperature, motion, door status, power consumption
-2. **Control devices**: Turn on/off smart plugs
-3. **Analyze data**: Compare values, detect patterns, provide insights
-
-## Available Modules
-
-### Sensor Query
-```python
-from rh_sensors.db.access import Sensors
-sensors = Sensors()
-
-# Get all sensors
-all_sensors = sensors.findSensors()
-# Returns: [{"sensorId": 1025, "name": "plug_0", "value": "100.5", "status": "On", "locationName": "Working area", ...}, ...]
-
-# Get single sensor
-sensor = sensors.getSensor(sensor_id)
-# Returns: {"name": "...", "value": "...", "status": "On/Off", "locationName": "...", "sensorTypeName": "..."}
-```
-
-### Device Control
-```python
-from rh_sensors.homecentre_actuators import ZWaveHomeActuator
-actuator = ZWaveHomeActuator()
-
-# Turn on device
-actuator.setValue(device_id, "turnOn", 1)
-
-# Turn off device
-actuator.setValue(device_id, "turnOff", 0)
-```
-
-### History Query
-```python
-from rh_sensors.homecentre_sensors import ZWaveHomeSensor
-sensor_api = ZWaveHomeSensor()
-history = sensor_api.getHistory(duration_ms)  # duration in milliseconds
-```
-
-## Device Mapping
-
-| Device Name | Sensor ID | Device ID | Room | Type | Controllable |
-|-------------|-----------|-----------|------|------|--------------|
-| plug_0 | 1025 | 25 | Working area | plug | Yes |
-| plug_1 | 1035 | 35 | Robot Corner | plug | Yes |
-| plug_2 | 1037 | 37 | Kaspar Room | plug | Yes |
-| plug_3 | 1039 | 39 | Entrance | plug | Yes |
-| plug_4 | 1041 | 41 | Working area | plug | Yes |
-| motion_0_temperature | 1028 | 28 | Working area | temperature | No |
-| motion_1_temperature | 1060 | 60 | Entrance | temperature | No |
-| motion_2_temperature | 1066 | 66 | Observation Room | temperature | No |
-| motion_3_temperature | 1072 | 72 | Kaspar Room | temperature | No |
-| motion_4_temperature | 1078 | 78 | Robot Corner | temperature | No |
-
-## Rooms
-- Working area
-- Robot Corner
-- Kaspar Room
-- Entrance
-- Observation Room
-
-## Rules for Code Generation
-
-1. **Always generate executable Python code** in a ```python ... ``` block
-2. **Use print() statements** to output results - this is how you communicate with users
-3. **Handle errors gracefully** - use try/except for database operations
-4. **Be concise** - generate minimal code that accomplishes the task
-5. **Use the correct IDs** - refer to the device mapping table above
-6. **Format output nicely** - use emojis and clear formatting for user-friendly responses
-
-## Example Interactions
-
-User: "What's the temperature in Robot Corner?"
-```python
-from rh_sensors.db.access import Sensors
-sensors = Sensors()
-sensor = sensors.getSensor(1078)  # motion_4_temperature
-temp = sensor['value'] if sensor else "N/A"
-print(f"thermometer Robot Corner temperature: {temp} degrees C")
-```
-
-User: "Turn off the plug in Entrance"
-```python
-from rh_sensors.homecentre_actuators import ZWaveHomeActuator
-actuator = ZWaveHomeActuator()
-result = actuator.setValue(39, "turnOff", 0)  # plug_3, Entrance
-print("checkmark Entrance plug (plug_3) has been turned off")
-```
-
-User: "Which room is warmest?"
-```python
-from rh_sensors.db.access import Sensors
-sensors = Sensors()
-
-temp_sensors = [
-    (1028, "Working area"),
-    (1060, "Entrance"),
-    (1066, "Observation Room"),
-    (1072, "Kaspar Room"),
-    (1078, "Robot Corner"),
-]
-
-temps = []
-for sid, room in temp_sensors:
-    s = sensors.getSensor(sid)
-    if s and s['value']:
-        try:
-            temps.append((float(s['value']), room))
-        except:
-            pass
-
-if temps:
-    temps.sort(reverse=True)
-    warmest = temps[0]
-    print(f"fire The warmest room is {warmest[1]} at {warmest[0]:.1f} degrees C")
-    print("\\nAll temperatures:")
-    for temp, room in temps:
-        print(f"  bullet {room}: {temp:.1f} degrees C")
-else:
-    print("X Could not read temperature sensors")
-```
-"""
+from .memory import MemoryStore, today_date
+from .llm_provider import ChatMessage
+
+
+@dataclass(frozen=True, slots=True)
+class DeviceInfo:
+    """A testbed device as described to the LLM."""
+    name: str
+    sensor_id: int
+    device_id: int
+    room: str
+    type: str
+    controllable: bool = False
+
+
+# Devices listed in the system prompt, keyed by sensor ID
+DEVICES: dict[int, DeviceInfo] = {
+    d.sensor_id: d
+    for d in (
+        DeviceInfo("plug_0", 1025, 25, "Working area", "plug", True),
+        DeviceInfo("plug_1", 1035, 35, "Robot Corner", "plug", True),
+        DeviceInfo("plug_2", 1037, 37, "Kaspar Room", "plug", True),
+        DeviceInfo("plug_3", 1039, 39, "Entrance", "plug", True),
+        DeviceInfo("plug_4", 1041, 41, "Working area", "plug", True),
+        DeviceInfo("motion_0_temperature", 1028, 28, "Working area", "temperature"),
+        DeviceInfo("motion_1_temperature", 1060, 60, "Entrance", "temperature"),
+        DeviceInfo("motion_2_temperature", 1066, 66, "Observation Room", "temperature"),
+        DeviceInfo("motion_3_temperature", 1072, 72, "Kaspar Room", "temperature"),
+        DeviceInfo("motion_4_temperature", 1078, 78, "Robot Corner", "temperature"),
+    )
+}
+
+
+def get_device(sensor_id: int) -> Optional[DeviceInfo]:
+    """Look up a device by sensor ID."""
+    return DEVICES.get(sensor_id)
+
+
+def _device_table() -> str:
+    """Render DEVICES as the markdown mapping table used in the prompt."""
+    rows = [
+        "| Device Name | Sensor ID | Device ID | Room | Type | Controllable |",
+        "|-------------|-----------|-----------|------|------|--------------|",
+    ]
+    for d in DEVICES.values():
+        controllable = "Yes" if d.controllable else "No"
+        rows.append(f"| {d.name} | {d.sensor_id} | {d.device_id} | {d.room} | {d.type} | {controllable} |")
+    return "\n".join(rows)
+
+
+# Core system prompt for LinguaHome, kept in system_prompt.md and loaded on
+# first use (access SYSTEM_PROMPT or call get_system_prompt())
+SYSTEM_PROMPT_FILE = Path(__file__).with_name("system_prompt.md")
+
+
+@functools.lru_cache(maxsize=1)
+def get_system_prompt() -> str:
+    """Get the default system prompt, with the device table filled in from DEVICES."""
+    template = SYSTEM_PROMPT_FILE.read_text(encoding="utf-8")
+    return template.replace("{DEVICE_TABLE}", _device_table())
+
+
+def __getattr__(name: str):
+    """Load SYSTEM_PROMPT lazily on first access."""
+    if name == "SYSTEM_PROMPT":
+        return get_system_prompt()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# User prompt wrapped around each request, split once around the message
+USER_PROMPT_TEMPLATE = """User request: {user_message}
+
+Generate Python code to handle this request. Remember to:
+1. Use the correct sensor/device IDs from the mapping
+2. Use print() for all output
+3. Handle potential errors
+4. Format output nicely with emojis"""
+_USER_PROMPT_PREFIX, _USER_PROMPT_SUFFIX = USER_PROMPT_TEMPLATE.split("{user_message}")
+
+
+def user_message_from_prompt(prompt: str) -> str:
+    """Recover the raw user message from a prompt built by build_user_prompt."""
+    if prompt.startswith(_USER_PROMPT_PREFIX) and prompt.endswith(_USER_PROMPT_SUFFIX):
+        return prompt[len(_USER_PROMPT_PREFIX):len(prompt) - len(_USER_PROMPT_SUFFIX)]
+    return prompt
 
 
 class ContextBuilder:
@@ -146,34 +102,55 @@ class ContextBuilder:
     
     def __init__(self, memory: Optional[MemoryStore] = None):
         self.memory = memory
+        
+        # Assembled prompts, rebuilt only when memory (or the day) changes
+        self._memory_version = None
+        self._cached_prompt: Optional[str] = None
+        self._cached_messages: list[ChatMessage] = [{"role": "system", "content": get_system_prompt()}]
+    
+    def _refresh(self) -> None:
+        """Rebuild the cached prompts if memory has changed since last time."""
+        if not self.memory:
+            return
+        
+        # Recent activity is read from today's log, so the date is part of the key
+        version = (self.memory.version, today_date())
+        if version == self._memory_version:
+            return
+        
+        messages = [self._cached_messages[0]]
+        prompt = None
+        memory_context = self.memory.get_memory_context()
+        if memory_context:
+            messages.append({
+                "role": "system",
+                "content": "## Context from Previous Sessions\n" + memory_context,
+            })
+            prompt = get_system_prompt() + "\n\n\n## Context from Previous Sessions\n\n" + memory_context
+        
+        self._cached_messages = messages
+        self._cached_prompt = prompt
+        self._memory_version = version
     
     def build_system_prompt(self) -> str:
         """Build the complete system prompt."""
-        parts = [SYSTEM_PROMPT]
-        
-        # Add memory context if available
-        if self.memory:
-            memory_context = self.memory.get_memory_context()
-            if memory_context:
-                parts.append("\n\n## Context from Previous Sessions\n")
-                parts.append(memory_context)
+        self._refresh()
+        return self._cached_prompt or get_system_prompt()
+    
+    def build_system_messages(self) -> list[ChatMessage]:
+        """
+        Build the system prompt as separate messages.
         
-        return "\n".join(parts)
+        The static SYSTEM_PROMPT always comes first and unchanged, so
+        provider prompt caching can reuse its prefix across turns; the
+        memory context follows in its own message.
+        """
+        self._refresh()
+        return list(self._cached_messages)
     
     def build_user_prompt(self, user_message: str) -> str:
         """Build the user prompt."""
-        return f"""User request: {user_message}
-
-Generate Python code to handle this request. Remember to:
-1. Use the correct sensor/device IDs from the mapping
-2. Use print() for all output
-3. Handle potential errors
-4. Format output nicely with emojis"""
-
-
-def get_system_prompt() -> str:
-    """Get the default system prompt."""
-    return SYSTEM_PROMPT
+        return _USER_PROMPT_PREFIX + user_message + _USER_PROMPT_SUFFIX
 
 
 if __name__ == "__main__":
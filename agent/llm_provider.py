@@ -5,10 +5,25 @@ Simplified LLM provider supporting only OpenAI, Anthropic, and Gemini.
 """
 
 import os
-from typing import List, Dict, Optional
+import json
+import asyncio
+import time
+import bisect
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple, Any, AsyncIterator, Callable, Union
 from dataclasses import dataclass
 from enum import Enum
 
+# orjson for faster request hashing (optional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 
 class LLMModel(Enum):
     """Supported LLM models."""
@@ -51,42 +66,485 @@ MODEL_ALIASES = {
 }
 
 
-@dataclass
+# litellm-ready chat message: {"role": ..., "content": ...}
+# This is the canonical form used on the hot path.
+ChatMessage = Dict[str, str]
+
+
+@dataclass(slots=True, frozen=True)
 class Message:
     """Chat message."""
     role: str  # "system", "user", "assistant"
     content: str
+    
+    def to_dict(self) -> ChatMessage:
+        """Convert to a litellm-ready message dict."""
+        return {"role": self.role, "content": self.content}
+    
+    @classmethod
+    def from_dict(cls, message: ChatMessage) -> "Message":
+        """Create from a litellm-ready message dict."""
+        return cls(role=message["role"], content=message["content"])
+
+
+def _as_dicts(messages: List[Union[Message, ChatMessage]]) -> List[ChatMessage]:
+    """
+    Return messages in litellm-ready dict form.
+    
+    Dict lists (the canonical form) are passed through untouched; lists of
+    Message objects are converted at this boundary.
+    """
+    if messages and isinstance(messages[0], Message):
+        return [msg.to_dict() for msg in messages]
+    return messages
+
+
+@dataclass(slots=True, frozen=True)
+class Usage:
+    """Token usage of an LLM call."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class LLMResponse:
     """LLM response."""
     content: str
     model: str
-    usage: Dict[str, int]
+    usage: Usage
+
+
+# Model name prefix -> provider, checked in order for unlisted models
+_PROVIDER_PREFIXES = (
+    ("gpt", "openai"),
+    ("o1", "openai"),
+    ("claude", "anthropic"),
+    ("gemini", "google"),
+)
+
+
+def _provider_for_prefix(model_lower: str) -> str:
+    """Determine provider from a lowercased model name prefix."""
+    for prefix, provider in _PROVIDER_PREFIXES:
+        if model_lower.startswith(prefix):
+            return provider
+    return "unknown"
+
+
+# Precomputed provider for every known model name and alias
+_MODEL_TO_PROVIDER = {m.value: _provider_for_prefix(m.value) for m in LLMModel}
+_MODEL_TO_PROVIDER.update(
+    {alias: _provider_for_prefix(target) for alias, target in MODEL_ALIASES.items()}
+)
 
 
 def resolve_model(model: str) -> str:
     """Resolve model alias to full model name."""
-    return MODEL_ALIASES.get(model.lower(), model)
+    return MODEL_ALIASES.get(model) or MODEL_ALIASES.get(model.lower(), model)
 
 
 def get_provider_from_model(model: str) -> str:
     """Determine provider from model name."""
-    model_lower = model.lower()
-    if model_lower.startswith("gpt") or model_lower.startswith("o1"):
-        return "openai"
-    elif model_lower.startswith("claude"):
-        return "anthropic"
-    elif model_lower.startswith("gemini"):
-        return "google"
-    else:
-        return "unknown"
+    return _MODEL_TO_PROVIDER.get(model) or _provider_for_prefix(model.lower())
+
+
+class OnnxEmbedder:
+    """
+    Sentence embedder running an ONNX export of a sentence-transformers model.
+    
+    Export once with:
+        optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 ./minilm-onnx
+    
+    An int8 model produced by optimum's ORTQuantizer can be loaded by passing
+    its file name as `model_file`.
+    """
+    
+    def __init__(self, model_dir: str, model_file: str = "model.onnx", max_length: int = 256):
+        try:
+            import numpy as np
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError(
+                "ONNX embedder requires onnxruntime and tokenizers. "
+                "Install with: pip install onnxruntime tokenizers"
+            )
+        
+        self._np = np
+        model_path = os.path.join(model_dir, model_file)
+        
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            model_path, sess_options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._tokenizer.enable_padding()
+        self._tokenizer.enable_truncation(max_length=max_length)
+    
+    def __call__(self, texts: List[str]):
+        """Embed a batch of texts as unit-norm float32 vectors (one per row)."""
+        np = self._np
+        encodings = self._tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        inputs = {name: value for name, value in inputs.items() if name in self._input_names}
+        
+        hidden = self._session.run(None, inputs)[0]
+        
+        # Mean pooling over non-padding tokens, then L2 normalization
+        mask = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent async embedding requests into batched forward passes.
+    
+    Requests arriving within `window_ms` of the first pending one are embedded
+    together, up to `max_batch` texts per pass.
+    """
+    
+    def __init__(
+        self,
+        embedder: Callable[[List[str]], Any],
+        max_batch: int = 32,
+        window_ms: float = 20,
+    ):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def embed(self, text: str):
+        """Embed one text, batched with other concurrent requests."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._run())
+        
+        future = loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+    
+    async def _run(self) -> None:
+        """Collect pending requests into batches and embed them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                embeddings = await asyncio.to_thread(self.embedder, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), emb in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(emb)
+
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize to JSON bytes, using orjson when available."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+# HNSW graph parameters for the faiss-backed semantic cache
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 32
+
+
+class SemanticCache:
+    """
+    Semantic response cache for LLM calls.
+    
+    Responses are keyed by an embedding of the raw user message plus the
+    `history_turns` user turns before it, and grouped by a hash of the
+    static (first) system prompt, so prompts built for different purposes
+    never share entries. `query_fn` maps the last user turn to its raw
+    message, e.g. to strip a prompt template. A lookup returns the cached
+    response whose query embedding has cosine similarity >= threshold.
+    
+    At most `max_entries` responses are kept across all clusters; beyond
+    that the oldest entries of the least recently written cluster go first.
+    
+    Embeddings come from a local sentence-transformers model unless an
+    `embedder` (e.g. OnnxEmbedder) is given. Async lookups are batched
+    through an EmbeddingBatcher.
+    
+    When faiss is installed each cluster is searched through an HNSW
+    inner-product index; otherwise a brute-force numpy matmul is used.
+    
+    With `ttl` set, entries expire after that many seconds. The cached
+    content is the LLM reply (generated code), never executed output, so
+    replayed code still reads live sensor values.
+    """
+    
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        threshold: float = 0.92,
+        max_entries: int = 1024,
+        embedder: Optional[Callable[[List[str]], Any]] = None,
+        use_faiss: bool = True,
+        ttl: Optional[float] = None,
+        history_turns: int = 2,
+        query_fn: Optional[Callable[[str], str]] = None,
+    ):
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("Semantic cache requires numpy. Install with: pip install numpy")
+        
+        # Approximate-NN search is optional; the numpy matmul is the fallback
+        self._faiss = None
+        if use_faiss:
+            try:
+                import faiss
+                self._faiss = faiss
+            except ImportError:
+                pass
+        
+        if embedder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                raise ImportError(
+                    "Semantic cache requires sentence-transformers. "
+                    "Install with: pip install sentence-transformers"
+                )
+            model = SentenceTransformer(model_name)
+            embedder = functools.partial(model.encode, normalize_embeddings=True)
+        
+        self._np = np
+        self._embedder = embedder
+        self._batcher = EmbeddingBatcher(self._embed_batch)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self.query_fn = query_fn
+        
+        # system prompt hash -> [embedding matrix, cached responses,
+        # faiss index or None, expiry times (ascending, insertion order)],
+        # least recently written cluster first
+        self._clusters: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._size = 0
+        # Lookups and stores may come from worker threads (the sync chat()),
+        # so cluster reads and updates are locked; embedding happens outside
+        self._lock = threading.Lock()
+    
+    def _split(self, messages: List[ChatMessage]) -> Tuple[str, Optional[str]]:
+        """Return (static system prompt hash, text to embed) for a message list."""
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        system_hash = hashlib.blake2b(system.encode("utf-8"), digest_size=16).hexdigest()
+        
+        turns = [m["content"] for m in messages if m["role"] == "user"][-(self.history_turns + 1):]
+        if not turns:
+            return system_hash, None
+        if self.query_fn is not None:
+            turns[-1] = self.query_fn(turns[-1])
+        return system_hash, "\n".join(turns)
+    
+    def _embed_batch(self, texts: List[str]):
+        """Embed texts as unit-norm float32 vectors (one per row)."""
+        return self._np.asarray(self._embedder(texts), dtype=self._np.float32)
+    
+    def _build_index(self, matrix):
+        """Build an HNSW inner-product index over the rows of matrix."""
+        index = self._faiss.IndexHNSWFlat(matrix.shape[1], HNSW_NEIGHBORS, self._faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        index.add(matrix)
+        return index
+    
+    def _drop_oldest(self, cluster: List[Any], count: int) -> None:
+        """Remove the `count` oldest entries of a cluster."""
+        matrix, responses, index, expires = cluster
+        count = min(count, len(responses))
+        self._size -= count
+        matrix = matrix[count:]
+        del responses[:count]
+        del expires[:count]
+        cluster[0] = matrix
+        # HNSW has no removal, so the index is rebuilt
+        if index is not None and responses:
+            cluster[2] = self._build_index(matrix)
+    
+    def _expire(self, system_hash: str) -> bool:
+        """Drop expired entries; return False if the cluster is now empty."""
+        cluster = self._clusters.get(system_hash)
+        if cluster is None:
+            # Emptied by a concurrent lookup while this one was embedding
+            return False
+        expires = cluster[3]
+        if expires[0] > time.monotonic():
+            return True
+        
+        # Entries share one TTL, so the expired ones are a prefix
+        self._drop_oldest(cluster, bisect.bisect_right(expires, time.monotonic()))
+        if not cluster[1]:
+            del self._clusters[system_hash]
+            return False
+        return True
+    
+    def _match(self, system_hash: str, emb) -> Optional[LLMResponse]:
+        """Return the most similar cached response above the threshold."""
+        if not self._expire(system_hash):
+            return None
+        matrix, responses, index, _ = self._clusters[system_hash]
+        # Embeddings are normalized, so the inner product is the cosine similarity
+        if index is not None:
+            sims, ids = index.search(emb[self._np.newaxis, :], 1)
+            best, sim = int(ids[0, 0]), sims[0, 0]
+            if best < 0:
+                return None
+        else:
+            sims = matrix @ emb
+            best = int(sims.argmax())
+            sim = sims[best]
+        if sim >= self.threshold:
+            return responses[best]
+        return None
+    
+    def _insert(self, system_hash: str, emb, response: LLMResponse) -> None:
+        """Add an entry to its system prompt cluster."""
+        emb = emb[self._np.newaxis, :]
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        cluster = self._clusters.get(system_hash)
+        if cluster is None:
+            index = self._build_index(emb) if self._faiss is not None else None
+            self._clusters[system_hash] = [emb, [response], index, [expiry]]
+        else:
+            cluster[0] = self._np.vstack([cluster[0], emb])
+            cluster[1].append(response)
+            cluster[3].append(expiry)
+            if cluster[2] is not None:
+                cluster[2].add(emb)
+            self._clusters.move_to_end(system_hash)
+        
+        self._size += 1
+        if self._size > self.max_entries:
+            # Drop the oldest tenth at once so index rebuilds are amortized
+            self._evict(max(1, self.max_entries // 10))
+    
+    def _evict(self, count: int) -> None:
+        """Drop `count` entries, oldest first from the least recently written clusters."""
+        while count > 0 and self._clusters:
+            system_hash, cluster = next(iter(self._clusters.items()))
+            dropped = min(count, len(cluster[1]))
+            self._drop_oldest(cluster, dropped)
+            count -= dropped
+            if not cluster[1]:
+                del self._clusters[system_hash]
+    
+    def lookup(self, messages: List[ChatMessage]) -> Optional[LLMResponse]:
+        """Return a cached response for a semantically similar request."""
+        system_hash, query = self._split(messages)
+        if query is None or system_hash not in self._clusters:
+            return None
+        emb = self._embed_batch([query])[0]
+        with self._lock:
+            return self._match(system_hash, emb)
+    
+    async def lookup_async(self, messages: List[ChatMessage]) -> Optional[LLMResponse]:
+        """Async lookup; the query embedding is batched with concurrent requests."""
+        system_hash, query = self._split(messages)
+        if query is None or system_hash not in self._clusters:
+            return None
+        emb = await self._batcher.embed(query)
+        with self._lock:
+            return self._match(system_hash, emb)
+    
+    def store(self, messages: List[ChatMessage], response: LLMResponse) -> None:
+        """Cache a response for the request it answered."""
+        system_hash, query = self._split(messages)
+        if query is not None:
+            emb = self._embed_batch([query])[0]
+            with self._lock:
+                self._insert(system_hash, emb, response)
+    
+    async def store_async(self, messages: List[ChatMessage], response: LLMResponse) -> None:
+        """Async store; the query embedding is batched with concurrent requests."""
+        system_hash, query = self._split(messages)
+        if query is not None:
+            emb = await self._batcher.embed(query)
+            with self._lock:
+                self._insert(system_hash, emb, response)
+    
+    def clear(self) -> None:
+        """Drop all cached responses."""
+        with self._lock:
+            self._clusters.clear()
+            self._size = 0
+
+
+# litellm module, configured once per process by _get_litellm()
+_litellm = None
+
+
+def _get_litellm():
+    """
+    Import and configure litellm once per process.
+    
+    Installs shared keep-alive HTTP clients (HTTP/2 when the h2 package is
+    available) so all LLMProvider instances reuse connections to the
+    provider instead of paying a TLS handshake per user.
+    """
+    global _litellm
+    if _litellm is not None:
+        return _litellm
+    
+    try:
+        import litellm
+    except ImportError:
+        raise ImportError("litellm is required. Install with: pip install litellm")
+    
+    litellm.set_verbose = False
+    
+    import httpx
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    try:
+        litellm.client_session = httpx.Client(http2=True, limits=limits, timeout=60)
+        litellm.aclient_session = httpx.AsyncClient(http2=True, limits=limits, timeout=60)
+    except ImportError:
+        # HTTP/2 support needs the h2 package; keep-alive pooling still applies
+        litellm.client_session = httpx.Client(limits=limits, timeout=60)
+        litellm.aclient_session = httpx.AsyncClient(limits=limits, timeout=60)
+    
+    _litellm = litellm
+    return _litellm
 
 
 class LLMProvider:
     """
     LLM provider using litellm for OpenAI, Anthropic, and Gemini.
+    
+    All instances share one process-wide litellm HTTP client pool.
     """
     
     def __init__(
@@ -94,19 +552,34 @@ class LLMProvider:
         model: str = "gpt-4o",
         temperature: float = 0.1,
         max_tokens: int = 4096,
+        semantic_cache: Optional[SemanticCache] = None,
+        exact_cache_size: int = 2048,
     ):
         self.model = resolve_model(model)
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.provider = get_provider_from_model(self.model)
+        self.semantic_cache = semantic_cache
+        self.exact_cache_size = exact_cache_size
         
-        # Check for litellm
-        try:
-            import litellm
-            self._litellm = litellm
-            litellm.set_verbose = False
-        except ImportError:
-            raise ImportError("litellm is required. Install with: pip install litellm")
+        # Exact-match response cache keyed by request hash (LRU). With the
+        # default low temperature, identical requests give near-identical
+        # answers, so this is checked before the semantic cache.
+        self._exact_cache: "OrderedDict[str, LLMResponse]" = OrderedDict()
+        # The sync chat() may run on worker threads, so cache updates are locked
+        self._exact_lock = threading.Lock()
+        
+        # In-flight async requests, keyed by request hash
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
+        # Memoized system prompt hash state for request keys
+        self._sys_prefix: Optional[Tuple[str, Any]] = None
+        
+        # Handle of the registered system prompt prefix (see register_prefix)
+        self.prefix_cache_id: Optional[str] = None
+        
+        # Shared, process-wide litellm (and HTTP connection pool)
+        self._litellm = _get_litellm()
         
         # Verify API key is set
         self._verify_api_key()
@@ -125,61 +598,246 @@ class LLMProvider:
     
     async def chat_async(
         self,
-        messages: List[Message],
+        messages: List[Union[Message, ChatMessage]],
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
     ) -> LLMResponse:
         """Async chat completion."""
-        formatted_messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages
-        ]
+        messages = _as_dicts(messages)
+        temperature = temperature or self.temperature
+        max_tokens = max_tokens or self.max_tokens
+        
+        # Exact-match cache first: a hit skips the embedding model too
+        key = self._request_key(messages, temperature, max_tokens)
+        cached = self._exact_get(key)
+        if cached:
+            return cached
         
+        if self.semantic_cache:
+            cached = await self.semantic_cache.lookup_async(messages)
+            if cached:
+                return cached
+        
+        # Coalesce identical concurrent requests onto one in-flight LLM call
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._complete_async(key, messages, temperature, max_tokens)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one caller's cancellation doesn't cancel the shared call
+        return await asyncio.shield(task)
+    
+    def _request_key(
+        self,
+        messages: List[ChatMessage],
+        temperature: float,
+        max_tokens: int,
+    ) -> str:
+        """Hash a request's model, parameters and messages."""
+        hasher = self._prefix_hasher(messages[0]["content"]) if messages else None
+        if hasher is not None:
+            rest = messages[1:]
+        else:
+            hasher = hashlib.blake2b(digest_size=16)
+            rest = messages
+        hasher.update(_dumps([self.model, temperature, max_tokens, rest]))
+        return hasher.hexdigest()
+    
+    def _exact_get(self, key: str) -> Optional[LLMResponse]:
+        """Look up the exact-match cache, refreshing the entry's recency."""
+        with self._exact_lock:
+            result = self._exact_cache.get(key)
+            if result is not None:
+                self._exact_cache.move_to_end(key)
+            return result
+    
+    def _exact_put(self, key: str, result: LLMResponse) -> None:
+        """Insert into the exact-match cache, evicting the least recently used."""
+        if self.exact_cache_size <= 0:
+            return
+        with self._exact_lock:
+            self._exact_cache[key] = result
+            if len(self._exact_cache) > self.exact_cache_size:
+                self._exact_cache.popitem(last=False)
+    
+    def _prefix_hasher(self, system_prompt: str):
+        """
+        Return a fresh hasher already fed with the system prompt.
+        
+        The system prompt is identical across turns, so its serialization
+        and hash state are memoized and only copied per request.
+        """
+        # Prompt and hasher are swapped as one tuple so threads never mix them
+        prefix = self._sys_prefix
+        if prefix is None or (prefix[0] is not system_prompt and prefix[0] != system_prompt):
+            hasher = hashlib.blake2b(digest_size=16)
+            hasher.update(_dumps(system_prompt))
+            prefix = self._sys_prefix = (system_prompt, hasher)
+        return prefix[1].copy()
+    
+    def register_prefix(self, system_prompt: str) -> str:
+        """
+        Register the fixed system prompt shared by all conversations.
+        
+        Precomputes its request-key hash state and returns a cache id for it.
+        OpenAI requests then carry the id as `prompt_cache_key`, so requests
+        sharing the prefix are routed to the same prompt cache (Anthropic
+        uses the cache_control breakpoint instead). Any change to the system
+        prompt invalidates the provider-side cache; register it again.
+        """
+        self.prefix_cache_id = self._prefix_hasher(system_prompt).hexdigest()
+        return self.prefix_cache_id
+    
+    def _cache_params(self) -> Dict[str, Any]:
+        """Extra completion parameters for provider prompt caching."""
+        if self.provider == "openai" and self.prefix_cache_id:
+            return {"prompt_cache_key": self.prefix_cache_id}
+        return {}
+    
+    def _with_cache_control(self, messages: List[ChatMessage]) -> List[Dict[str, Any]]:
+        """
+        Mark the leading system prompt as a prompt-cache breakpoint.
+        
+        Anthropic only caches prefixes ending in an explicit cache_control
+        block; OpenAI and Gemini cache long common prefixes automatically,
+        so their messages are sent unchanged.
+        """
+        if self.provider != "anthropic" or not messages or messages[0]["role"] != "system":
+            return messages
+        first = {
+            "role": "system",
+            "content": [{
+                "type": "text",
+                "text": messages[0]["content"],
+                "cache_control": {"type": "ephemeral"},
+            }],
+        }
+        return [first, *messages[1:]]
+    
+    async def _complete_async(
+        self,
+        key: str,
+        messages: List[ChatMessage],
+        temperature: float,
+        max_tokens: int,
+    ) -> LLMResponse:
+        """Run a single async completion and cache its response."""
         response = await self._litellm.acompletion(
             model=self.model,
-            messages=formatted_messages,
-            temperature=temperature or self.temperature,
-            max_tokens=max_tokens or self.max_tokens,
+            messages=self._with_cache_control(messages),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **self._cache_params(),
         )
         
-        return LLMResponse(
+        result = LLMResponse(
             content=response.choices[0].message.content,
             model=response.model,
-            usage={
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens,
-            }
+            usage=Usage(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                total_tokens=response.usage.total_tokens,
+            ),
         )
+        
+        self._exact_put(key, result)
+        if self.semantic_cache:
+            await self.semantic_cache.store_async(messages, result)
+        
+        return result
+    
+    async def stream_chat_async(
+        self,
+        messages: List[Union[Message, ChatMessage]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """Async streaming chat completion, yielding content chunks as they arrive."""
+        messages = _as_dicts(messages)
+        temperature = temperature or self.temperature
+        max_tokens = max_tokens or self.max_tokens
+        
+        key = self._request_key(messages, temperature, max_tokens)
+        cached = self._exact_get(key)
+        if cached:
+            yield cached.content
+            return
+        
+        if self.semantic_cache:
+            cached = await self.semantic_cache.lookup_async(messages)
+            if cached:
+                yield cached.content
+                return
+        
+        response = await self._litellm.acompletion(
+            model=self.model,
+            messages=self._with_cache_control(messages),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **self._cache_params(),
+        )
+        
+        chunks = []
+        async for chunk in response:
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                chunks.append(delta)
+                yield delta
+        
+        # Streamed responses carry no usage accounting
+        result = LLMResponse(content="".join(chunks), model=self.model, usage=Usage())
+        self._exact_put(key, result)
+        if self.semantic_cache:
+            await self.semantic_cache.store_async(messages, result)
     
     def chat(
         self,
-        messages: List[Message],
+        messages: List[Union[Message, ChatMessage]],
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
     ) -> LLMResponse:
         """Synchronous chat completion."""
-        formatted_messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages
-        ]
+        messages = _as_dicts(messages)
+        temperature = temperature or self.temperature
+        max_tokens = max_tokens or self.max_tokens
+        
+        key = self._request_key(messages, temperature, max_tokens)
+        cached = self._exact_get(key)
+        if cached:
+            return cached
+        
+        if self.semantic_cache:
+            cached = self.semantic_cache.lookup(messages)
+            if cached:
+                return cached
         
         response = self._litellm.completion(
             model=self.model,
-            messages=formatted_messages,
-            temperature=temperature or self.temperature,
-            max_tokens=max_tokens or self.max_tokens,
+            messages=self._with_cache_control(messages),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **self._cache_params(),
         )
         
-        return LLMResponse(
+        result = LLMResponse(
             content=response.choices[0].message.content,
             model=response.model,
-            usage={
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens,
-            }
+            usage=Usage(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                total_tokens=response.usage.total_tokens,
+            ),
         )
+        
+        self._exact_put(key, result)
+        if self.semantic_cache:
+            self.semantic_cache.store(messages, result)
+        
+        return result
     
     def get_info(self) -> Dict:
         """Get provider information."""
@@ -188,6 +846,7 @@ class LLMProvider:
             "provider": self.provider,
             "temperature": self.temperature,
             "max_tokens": self.max_tokens,
+            "semantic_cache": self.semantic_cache is not None,
         }
 
 
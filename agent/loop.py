@@ -5,14 +5,19 @@ Core processing engine: User Message -> LLM -> Code -> Execute -> Response
 """
 
 import asyncio
+from collections import deque
 from pathlib import Path
-from typing import Optional, Callable, Awaitable
+from typing import Optional, Callable, Awaitable, Union
 from dataclasses import dataclass
 
 from .memory import MemoryStore
-from .context import ContextBuilder
+from .context import ContextBuilder, user_message_from_prompt
 from .code_executor import CodeExecutor
-from .llm_provider import LLMProvider, Message, LLMResponse
+from .llm_provider import LLMProvider, ChatMessage, SemanticCache
+
+
+# Conversation history: a bounded deque, or a plain list trimmed per turn
+History = Union[deque, list]
 
 
 @dataclass
@@ -43,36 +48,60 @@ class AgentLoop:
         temperature: float = 0.1,
         code_timeout: int = 30,
         safe_mode: bool = True,
+        semantic_cache: Optional[SemanticCache] = None,
+        llm: Optional[LLMProvider] = None,
+        executor: Optional[CodeExecutor] = None,
     ):
         self.workspace = workspace
         
-        # Initialize components
+        # Initialize components; an already-built LLM provider or executor
+        # can be passed in to share it (and its caches and worker pool)
+        # between agents
         self.memory = MemoryStore(workspace)
         self.context = ContextBuilder(self.memory)
-        self.executor = CodeExecutor(timeout=code_timeout, safe_mode=safe_mode)
-        self.llm = LLMProvider(model=llm_model, temperature=temperature)
+        self.executor = executor or CodeExecutor(timeout=code_timeout, safe_mode=safe_mode)
+        
+        # The semantic cache embeds the raw user message, not the templated prompt
+        if semantic_cache is not None and semantic_cache.query_fn is None:
+            semantic_cache.query_fn = user_message_from_prompt
+        self.llm = llm or LLMProvider(
+            model=llm_model,
+            temperature=temperature,
+            semantic_cache=semantic_cache,
+        )
         
-        # History for context
-        self.conversation_history: list[Message] = []
+        # Caps concurrent code executions at the executor's worker count, so
+        # extra requests wait here instead of occupying threads
+        self._exec_slots = asyncio.Semaphore(self.executor.processes)
+        
+        # History for context, stored as litellm-ready message dicts and
+        # bounded so long-lived sessions keep a fixed footprint
         self.max_history = 10
+        self.conversation_history: deque[ChatMessage] = deque(maxlen=self.max_history)
     
     def reset_conversation(self) -> None:
         """Reset conversation history."""
-        self.conversation_history = []
+        self.conversation_history.clear()
     
-    def process(self, user_message: str) -> AgentResponse:
+    def process(
+        self,
+        user_message: str,
+        history: Optional[History] = None,
+    ) -> AgentResponse:
         """
         Process a user message synchronously.
         
         Args:
             user_message: The user's natural language request
+            history: Conversation history to use and update; defaults to
+                this agent's own `conversation_history`
             
         Returns:
             AgentResponse with the result
         """
         try:
             # Build messages
-            messages = self._build_messages(user_message)
+            messages = self._build_messages(user_message, history)
             
             # Get LLM response
             llm_response = self.llm.chat(messages)
@@ -129,25 +158,46 @@ class AgentLoop:
                 success=False,
             )
     
-    async def process_async(self, user_message: str) -> AgentResponse:
+    async def process_async(
+        self,
+        user_message: str,
+        history: Optional[History] = None,
+        on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> AgentResponse:
         """
         Process a user message asynchronously.
+        
+        The agent holds no per-user state when `history` is given, so one
+        AgentLoop can serve many concurrent conversations.
+        
+        Args:
+            user_message: The user's natural language request
+            history: Conversation history to use and update; defaults to
+                this agent's own `conversation_history`
+            on_partial: Optional callback streaming the LLM text generated so
+                far. It stops being called once a code block starts, since the
+                final reply then comes from the executed code.
         """
         try:
             # Build messages
-            messages = self._build_messages(user_message)
+            messages = self._build_messages(user_message, history)
             
             # Get LLM response
-            llm_response = await self.llm.chat_async(messages)
+            if on_partial:
+                content = await self._stream_content(messages, on_partial)
+            else:
+                content = (await self.llm.chat_async(messages)).content
             
             # Extract and execute code
-            code = self.executor.extract_code_from_response(llm_response.content)
+            code = self.executor.extract_code_from_response(content)
             
             if code:
-                success, stdout, stderr = self.executor.execute(code)
+                # Execution and memory writes block, so keep them off the event loop
+                async with self._exec_slots:
+                    success, stdout, stderr = await asyncio.to_thread(self.executor.execute, code)
                 
                 if success and stdout:
-                    self.memory.remember_user_command(user_message, stdout[:100])
+                    await asyncio.to_thread(self.memory.remember_user_command, user_message, stdout[:100])
                     return AgentResponse(
                         message=stdout.strip(),
                         code_generated=code,
@@ -170,7 +220,7 @@ class AgentLoop:
                     )
             else:
                 return AgentResponse(
-                    message=llm_response.content,
+                    message=content,
                     success=True,
                 )
                 
@@ -180,25 +230,87 @@ class AgentLoop:
                 success=False,
             )
     
-    def _build_messages(self, user_message: str) -> list[Message]:
+    async def _stream_content(
+        self,
+        messages: list[ChatMessage],
+        on_partial: Callable[[str], Awaitable[None]],
+    ) -> str:
+        """Stream the LLM response, forwarding text until a code block starts."""
+        text = ""
+        forwarding = True
+        async for chunk in self.llm.stream_chat_async(messages):
+            text += chunk
+            if forwarding:
+                if "```" in text:
+                    forwarding = False
+                else:
+                    await on_partial(text.rstrip("`"))
+        return text
+    
+    def _build_messages(
+        self,
+        user_message: str,
+        history: Optional[History] = None,
+    ) -> list[ChatMessage]:
         """Build the message list for LLM."""
-        messages = [
-            Message(role="system", content=self.context.build_system_prompt())
-        ]
+        if history is None:
+            history = self.conversation_history
         
-        # Add conversation history (limited)
-        messages.extend(self.conversation_history[-self.max_history:])
+        # Static system prompt first so provider prefix caching hits
+        messages = self.context.build_system_messages()
+        
+        # Add conversation history (deques are already bounded by maxlen);
+        # skipped entirely on a conversation's first turn
+        if history:
+            if isinstance(history, deque):
+                messages.extend(history)
+            else:
+                messages.extend(history[-self.max_history:])
         
         # Add current user message
         user_prompt = self.context.build_user_prompt(user_message)
-        messages.append(Message(role="user", content=user_prompt))
+        messages.append({"role": "user", "content": user_prompt})
         
         # Update history
-        self.conversation_history.append(Message(role="user", content=user_message))
+        history.append({"role": "user", "content": user_message})
         
         return messages
 
 
+class AgentSession:
+    """
+    One user's conversation with a shared AgentLoop.
+    
+    The agent owns the LLM provider, code executor and cached system
+    prompt; a session holds only its own conversation history.
+    """
+    
+    __slots__ = ("agent", "user_id", "history")
+    
+    def __init__(self, agent: AgentLoop, user_id=None):
+        self.agent = agent
+        self.user_id = user_id
+        self.history: deque[ChatMessage] = deque(maxlen=agent.max_history)
+    
+    def process(self, user_message: str) -> AgentResponse:
+        """Process a user message synchronously within this conversation."""
+        return self.agent.process(user_message, history=self.history)
+    
+    async def process_async(
+        self,
+        user_message: str,
+        on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> AgentResponse:
+        """Process a user message asynchronously within this conversation."""
+        return await self.agent.process_async(
+            user_message, history=self.history, on_partial=on_partial
+        )
+    
+    def reset(self) -> None:
+        """Reset this conversation's history."""
+        self.history.clear()
+
+
 # Convenience function
 def create_agent(
     workspace: Path = None,
@@ -3,14 +3,63 @@ LinguaHome Memory System
 Simplified from NanoBot, focused on smart home context.
 """
 
+import json
+import time
+from collections import deque
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 from typing import Optional
 
+# orjson for faster log serialization (optional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 
 def today_date() -> str:
     """Get today's date string."""
-    return datetime.now().strftime("%Y-%m-%d")
+    return date.today().isoformat()
+
+
+def _now_time(fmt: str = "%H:%M:%S") -> str:
+    """Format the current local time."""
+    return time.strftime(fmt, time.localtime())
+
+
+# Number of today's log records kept in memory for the LLM context
+TODAY_BUFFER_SIZE = 200
+
+
+def _dumps_line(record: dict) -> bytes:
+    """Serialize a log record as one NDJSON line."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _loads_line(line: bytes) -> dict:
+    """Parse one NDJSON log line."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def _render_record(record: dict) -> str:
+    """Render a log record as a markdown list entry."""
+    if "sensor" in record:
+        return f"- [{record['t']}] {record['sensor']}: {record['v']} ({record['s']})"
+    if "cmd" in record:
+        return f"- [{record['t']}] Command: {record['cmd']}\n  Result: {record['result']}"
+    return record["text"]
+
+
+def _render_log(day: str, records) -> str:
+    """Render a day's log records as markdown."""
+    lines = [f"# LinguaHome Log - {day}\n"]
+    lines.extend(_render_record(r) for r in records)
+    return "\n".join(lines) + "\n"
 
 
 def ensure_dir(path: Path) -> Path:
@@ -24,39 +73,72 @@ class MemoryStore:
     Memory system for LinguaHome.
     
     Supports:
-    - Daily notes (memory/YYYY-MM-DD.md) for session context
+    - Daily log (memory/YYYY-MM-DD.ndjson) for session context, rendered
+      as markdown when read
     - Long-term memory (MEMORY.md) for user preferences
     - Sensor event logging
     """
     
+    # Today's date and log path, refreshed on date rollover
+    _today_str: str = ""
+    _today_path: Optional[Path] = None
+    
     def __init__(self, workspace: Path):
         self.workspace = workspace
         self.memory_dir = ensure_dir(workspace / "memory")
         self.memory_file = self.memory_dir / "MEMORY.md"
+        
+        # Bumped on every write so readers can cache derived context
+        self.version = 0
+        
+        # Recent writes to today's log, so context building doesn't re-read it
+        self._today_buffer: deque[str] = deque(maxlen=TODAY_BUFFER_SIZE)
+        self._buffer_date = ""
     
     def get_today_file(self) -> Path:
         """Get path to today's memory file."""
-        return self.memory_dir / f"{today_date()}.md"
+        today = today_date()
+        if today != self._today_str:
+            self._today_str = today
+            self._today_path = self.memory_dir / f"{today}.ndjson"
+        return self._today_path
+    
+    def _read_records(self, path: Path) -> list:
+        """Read the records of a daily log file."""
+        if not path.exists():
+            return []
+        with path.open("rb") as f:
+            return [_loads_line(line) for line in f if line.strip()]
     
     def read_today(self) -> str:
         """Read today's memory notes."""
-        today_file = self.get_today_file()
-        if today_file.exists():
-            return today_file.read_text(encoding="utf-8")
+        records = self._read_records(self.get_today_file())
+        if records:
+            return _render_log(self._today_str, records)
         return ""
     
-    def append_today(self, content: str) -> None:
-        """Append content to today's memory notes."""
+    def _today_entries(self) -> deque:
+        """Return the buffer of today's records, reloading it after date rollover."""
         today_file = self.get_today_file()
+        if self._buffer_date != self._today_str:
+            self._today_buffer.clear()
+            self._today_buffer.extend(self._read_records(today_file))
+            self._buffer_date = self._today_str
+        return self._today_buffer
+    
+    def _append_record(self, record: dict) -> None:
+        """Append a record to today's log."""
+        buffer = self._today_entries()
         
-        if today_file.exists():
-            existing = today_file.read_text(encoding="utf-8")
-            content = existing + "\n" + content
-        else:
-            header = f"# LinguaHome Log - {today_date()}\n\n"
-            content = header + content
-        
-        today_file.write_text(content, encoding="utf-8")
+        # Append mode writes only the new line instead of rewriting the log
+        with self._today_path.open("ab") as f:
+            f.write(_dumps_line(record))
+        buffer.append(record)
+        self.version += 1
+    
+    def append_today(self, content: str) -> None:
+        """Append content to today's memory notes."""
+        self._append_record({"text": content})
     
     def read_long_term(self) -> str:
         """Read long-term memory (MEMORY.md)."""
@@ -67,47 +149,53 @@ class MemoryStore:
     def write_long_term(self, content: str) -> None:
         """Write to long-term memory (MEMORY.md)."""
         self.memory_file.write_text(content, encoding="utf-8")
+        self.version += 1
     
     def append_long_term(self, content: str) -> None:
         """Append to long-term memory."""
-        existing = self.read_long_term()
-        if existing:
-            content = existing + "\n" + content
-        else:
-            content = "# LinguaHome User Preferences\n\n" + content
-        self.write_long_term(content)
+        new = not self.memory_file.exists() or self.memory_file.stat().st_size == 0
+        
+        with self.memory_file.open("a", encoding="utf-8") as f:
+            if new:
+                f.write("# LinguaHome User Preferences\n\n")
+            f.write(content + "\n")
+        self.version += 1
     
     def get_recent_memories(self, days: int = 3) -> str:
         """Get memories from the last N days."""
         memories = []
-        today = datetime.now().date()
+        today = date.today()
         
-        for i in range(days):
-            date = today - timedelta(days=i)
-            date_str = date.strftime("%Y-%m-%d")
-            file_path = self.memory_dir / f"{date_str}.md"
+        # Today's log is served from the in-memory buffer
+        entries = self._today_entries()
+        if entries:
+            memories.append(_render_log(self._today_str, entries))
+        
+        for i in range(1, days):
+            date_str = (today - timedelta(days=i)).isoformat()
+            records = self._read_records(self.memory_dir / f"{date_str}.ndjson")
+            if records:
+                memories.append(_render_log(date_str, records))
+                continue
             
+            # Logs written before the NDJSON format
+            file_path = self.memory_dir / f"{date_str}.md"
             if file_path.exists():
-                content = file_path.read_text(encoding="utf-8")
-                memories.append(content)
+                memories.append(file_path.read_text(encoding="utf-8"))
         
         return "\n\n---\n\n".join(memories)
     
     def remember_sensor_event(self, sensor_name: str, value: str, status: str) -> None:
         """Record a significant sensor event."""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        entry = f"- [{timestamp}] {sensor_name}: {value} ({status})"
-        self.append_today(entry)
+        self._append_record({"t": _now_time(), "sensor": sensor_name, "v": value, "s": status})
     
     def remember_user_command(self, command: str, result: str) -> None:
         """Record a user command and its result."""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        entry = f"- [{timestamp}] Command: {command}\n  Result: {result}"
-        self.append_today(entry)
+        self._append_record({"t": _now_time(), "cmd": command, "result": result})
     
     def remember_preference(self, preference: str) -> None:
         """Record a user preference to long-term memory."""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
+        timestamp = _now_time("%Y-%m-%d %H:%M")
         entry = f"- [{timestamp}] {preference}"
         self.append_long_term(entry)
     
@@ -1,6 +1,15 @@
 """LinguaHome Channels Module"""
 
-from .telegram_bot import TelegramBot
-from .whatsapp_bot import WhatsAppBot
-
 __all__ = ["TelegramBot", "WhatsAppBot"]
+
+
+def __getattr__(name):
+    # Lazy imports (PEP 562): each bot pulls in its own heavy SDKs, so only
+    # load the one actually used
+    if name == "TelegramBot":
+        from .telegram_bot import TelegramBot
+        return TelegramBot
+    if name == "WhatsAppBot":
+        from .whatsapp_bot import WhatsAppBot
+        return WhatsAppBot
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -8,8 +8,9 @@ Telegram integration for natural language smart home control.
 import os
 import asyncio
 import logging
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Set
+from typing import Callable, Set, TYPE_CHECKING
 
 # Telegram bot library
 try:
@@ -28,7 +29,9 @@ except ImportError:
 # LinguaHome components
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from agent.loop import AgentLoop
+
+if TYPE_CHECKING:
+    from agent.loop import AgentSession
 
 
 # Configure logging
@@ -38,6 +41,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Maximum number of per-user conversations kept in memory (least recently used evicted)
+MAX_CONVERSATIONS = 1000
+
+# Seconds between "typing" chat actions while a request is processed
+TYPING_INTERVAL = 4
+
+# Number of streamed LLM chunks between Telegram message edits
+# (editing on every token would hit Telegram's rate limits)
+STREAM_EDIT_EVERY = 20
+
+
+async def _keep_typing(chat) -> None:
+    """Re-send the typing action until cancelled."""
+    while True:
+        await chat.send_action("typing")
+        await asyncio.sleep(TYPING_INTERVAL)
+
 
 class TelegramBot:
     """
@@ -59,13 +79,27 @@ class TelegramBot:
         self.token = token
         self.workspace = workspace or Path.cwd()
         self.llm_model = llm_model
-        self.allowed_users = allowed_users or set()
+        self.allowed_users = frozenset(allowed_users or ())
+        
+        # Authorization check chosen once: no restrictions, or set membership
+        self._auth_check: Callable[[int], bool] = (
+            (lambda _user_id: True) if not self.allowed_users else self.allowed_users.__contains__
+        )
         
-        # Agent per user to maintain separate conversations
-        self.agents: dict[int, AgentLoop] = {}
+        # Deferred so importing this module doesn't load the agent stack
+        from agent.loop import AgentLoop
+        
+        # One shared agent, built here so misconfiguration fails at startup;
+        # each user only gets a lightweight session, created on first message
+        self.agent = AgentLoop(
+            workspace=self.workspace,
+            llm_model=self.llm_model,
+        )
+        self.sessions: "OrderedDict[int, AgentSession]" = OrderedDict()
         
-        # Build application
-        self.app = Application.builder().token(token).build()
+        # Build application; updates are handled concurrently so messages
+        # from different users overlap instead of queueing
+        self.app = Application.builder().token(token).concurrent_updates(True).build()
         self._register_handlers()
     
     def _register_handlers(self) -> None:
@@ -75,26 +109,25 @@ class TelegramBot:
         self.app.add_handler(CommandHandler("clear", self._clear_command))
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self._handle_message))
     
-    def _is_authorized(self, user_id: int) -> bool:
-        """Check if user is authorized."""
-        if not self.allowed_users:
-            return True  # No restrictions
-        return user_id in self.allowed_users
-    
-    def _get_agent(self, user_id: int) -> AgentLoop:
-        """Get or create agent for user."""
-        if user_id not in self.agents:
-            self.agents[user_id] = AgentLoop(
-                workspace=self.workspace,
-                llm_model=self.llm_model,
-            )
-        return self.agents[user_id]
+    def _get_session(self, user_id: int) -> "AgentSession":
+        """Get or create the conversation session for user."""
+        session = self.sessions.get(user_id)
+        if session is not None:
+            self.sessions.move_to_end(user_id)
+            return session
+        
+        from agent.loop import AgentSession
+        session = AgentSession(self.agent, user_id)
+        self.sessions[user_id] = session
+        if len(self.sessions) > MAX_CONVERSATIONS:
+            self.sessions.popitem(last=False)
+        return session
     
     async def _start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /start command."""
         user_id = update.effective_user.id
         
-        if not self._is_authorized(user_id):
+        if not self._auth_check(user_id):
             await update.message.reply_text("X Unauthorized. Contact the administrator.")
             return
         
@@ -129,8 +162,7 @@ class TelegramBot:
         """Handle /clear command."""
         user_id = update.effective_user.id
         
-        if user_id in self.agents:
-            self.agents[user_id].reset_conversation()
+        self.sessions.pop(user_id, None)
         
         await update.message.reply_text("recycle Conversation cleared. Start fresh!")
     
@@ -138,32 +170,66 @@ class TelegramBot:
         """Handle regular text messages."""
         user_id = update.effective_user.id
         
-        if not self._is_authorized(user_id):
+        if not self._auth_check(user_id):
             await update.message.reply_text("X Unauthorized.")
             return
         
         user_message = update.message.text
         logger.info(f"User {user_id}: {user_message}")
         
-        # Show typing indicator
-        await update.message.chat.send_action("typing")
+        # Keep the typing indicator alive (Telegram clears it after ~5s)
+        typing_task = asyncio.create_task(_keep_typing(update.message.chat))
         
         try:
-            # Get agent and process
-            agent = self._get_agent(user_id)
-            response = await agent.process_async(user_message)
+            # Placeholder message, edited as the LLM response streams in
+            reply = await update.message.reply_text("hourglass Thinking...")
+            sent_text = reply.text
+            chunks = 0
+            
+            async def on_partial(text: str) -> None:
+                nonlocal sent_text, chunks
+                chunks += 1
+                if chunks % STREAM_EDIT_EVERY == 0 and text.strip() and text != sent_text:
+                    await reply.edit_text(text)
+                    sent_text = text
+            
+            # Process with the shared agent
+            session = self._get_session(user_id)
+            response = await session.process_async(user_message, on_partial=on_partial)
             
-            # Send response
-            await update.message.reply_text(response.message)
+            # Send final response
+            if response.message != sent_text:
+                await reply.edit_text(response.message)
             
             logger.info(f"Response sent: {response.message[:50]}...")
             
         except Exception as e:
             logger.error(f"Error processing message: {e}")
             await update.message.reply_text(f"X Error: {str(e)}")
+        finally:
+            typing_task.cancel()
     
     def run(self) -> None:
-        """Run the bot."""
+        """
+        Run the bot.
+        
+        Uses a webhook when WEBHOOK_URL is set, so the bot only wakes up on
+        real updates; otherwise falls back to long polling.
+        """
+        webhook_url = os.environ.get("WEBHOOK_URL")
+        if webhook_url:
+            port = int(os.environ.get("PORT", "8443"))
+            logger.info(f"Starting LinguaHome Telegram Bot (webhook on port {port})...")
+            # The token as URL path keeps the endpoint unguessable
+            self.app.run_webhook(
+                listen="0.0.0.0",
+                port=port,
+                url_path=self.token,
+                webhook_url=f"{webhook_url.rstrip('/')}/{self.token}",
+                allowed_updates=Update.ALL_TYPES,
+            )
+            return
+        
         logger.info("Starting LinguaHome Telegram Bot...")
         self.app.run_polling(allowed_updates=Update.ALL_TYPES)
 
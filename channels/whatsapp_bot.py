@@ -6,29 +6,26 @@ WhatsApp integration using Twilio API.
 """
 
 import os
+import re
+import json
+import time
+import random
+import asyncio
 import logging
+from collections import OrderedDict
+from html import escape
 from pathlib import Path
-from typing import Set
-
-# Flask for webhook
-try:
-    from flask import Flask, request
-    FLASK_AVAILABLE = True
-except ImportError:
-    FLASK_AVAILABLE = False
-
-# Twilio
-try:
-    from twilio.rest import Client
-    from twilio.twiml.messaging_response import MessagingResponse
-    TWILIO_AVAILABLE = True
-except ImportError:
-    TWILIO_AVAILABLE = False
+from typing import Callable, List, Set, Tuple, TYPE_CHECKING
+
+# Quart (async Flask-compatible API), Hypercorn and Twilio are imported
+# where first needed, so importing this module stays cheap for CLI/tests
 
 # LinguaHome components
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from agent.loop import AgentLoop
+
+if TYPE_CHECKING:
+    from agent.loop import AgentSession
 
 
 # Configure logging
@@ -38,12 +35,102 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Maximum number of per-user conversations kept in memory (least recently used evicted)
+MAX_CONVERSATIONS = int(os.environ.get("WHATSAPP_MAX_CONVERSATIONS", "1000"))
+
+# Conversations idle for longer than this many seconds are dropped (0 disables)
+CONVERSATION_TTL = float(os.environ.get("WHATSAPP_CONVERSATION_TTL", "0"))
+
+# Seconds to wait for an agent reply inside the webhook; slower replies are
+# sent as a follow-up message (Twilio gives up on webhook responses after
+# 15 seconds)
+AGENT_TIMEOUT = float(os.environ.get("WHATSAPP_AGENT_TIMEOUT", "14"))
+
+# Twilio rejects WhatsApp message bodies longer than this
+MAX_MESSAGE_LENGTH = 1600
+
+# Twilio errors worth retrying (rate limiting and transient server errors)
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_SENTENCE_END = re.compile(r"(?<=[.!?\n])")
+
+# Fixed replies
+WELCOME_TEXT = (
+    "welcome LinguaHome Smart Home Assistant\n\n"
+    "I can help you control your smart home.\n\n"
+    "Examples:\n"
+    "- What's the temperature?\n"
+    "- Turn off the entrance plug\n"
+    "- Which room is warmest?\n\n"
+    "Send /clear to reset conversation."
+)
+CLEAR_TEXT = "recycle Conversation cleared!"
+UNAUTHORIZED_TEXT = "X Unauthorized. Contact the administrator."
+RATE_LIMITED_TEXT = "hourglass Too many requests, slow down."
+BUSY_TEXT = "hourglass I'm busy right now, please try again shortly."
+WORKING_TEXT = "hourglass Still working on it, I'll send the answer shortly."
+
+
+def normalize_number(number: str) -> str:
+    """Normalize a phone number to Twilio's "whatsapp:+<digits>" From format."""
+    number = number.strip().replace(" ", "")
+    if number.lower().startswith("whatsapp:"):
+        number = number[len("whatsapp:"):]
+    return "whatsapp:" + number
+
+
+# TwiML rendered by plain string formatting instead of building an XML tree
+_TWIML_FMT = '<?xml version="1.0" encoding="UTF-8"?><Response>{}</Response>'
+_MESSAGE_FMT = "<Message>{}</Message>"
+
+
+def _twiml(*texts: str) -> str:
+    """Render a TwiML reply with one message per text."""
+    return _TWIML_FMT.format("".join(_MESSAGE_FMT.format(escape(t, quote=False)) for t in texts))
+
+
+# Fixed replies rendered to TwiML once instead of per request
+WELCOME_TWIML = _twiml(WELCOME_TEXT)
+CLEAR_TWIML = _twiml(CLEAR_TEXT)
+UNAUTHORIZED_TWIML = _twiml(UNAUTHORIZED_TEXT)
+RATE_LIMITED_TWIML = _twiml(RATE_LIMITED_TEXT)
+BUSY_TWIML = _twiml(BUSY_TEXT)
+WORKING_TWIML = _twiml(WORKING_TEXT)
+EMPTY_TWIML = _twiml()
+
+
+# /health response body, encoded once
+HEALTH_BODY = json.dumps({"status": "ok", "service": "LinguaHome WhatsApp Bot"}).encode("utf-8")
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Split a reply into chunks of at most `limit` chars at sentence boundaries."""
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > limit:
+            # A single sentence longer than the limit is hard-split
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:limit])
+            sentence = sentence[limit:]
+        if len(current) + len(sentence) > limit:
+            chunks.append(current)
+            current = ""
+        current += sentence
+    if current.strip():
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
 
 class WhatsAppBot:
     """
     WhatsApp bot for LinguaHome using Twilio.
     
-    Provides a Flask webhook to receive WhatsApp messages.
+    Provides an async Quart webhook to receive WhatsApp messages, so LLM
+    calls from concurrent users overlap instead of queueing.
     """
     
     def __init__(
@@ -54,10 +141,21 @@ class WhatsAppBot:
         workspace: Path = None,
         llm_model: str = "gpt-4o",
         allowed_numbers: Set[str] = None,
+        max_retries: int = 5,
+        retry_base: float = 0.5,
+        retry_cap: float = 8.0,
+        rate_capacity: float = 5,
+        rate_per_sec: float = 0.1,
+        send_concurrency: int = 10,
+        max_inflight: int = 20,
     ):
-        if not FLASK_AVAILABLE:
-            raise ImportError("Flask not installed. Run: pip install flask")
-        if not TWILIO_AVAILABLE:
+        try:
+            from quart import Quart
+        except ImportError:
+            raise ImportError("Quart not installed. Run: pip install quart hypercorn")
+        try:
+            from twilio.rest import Client
+        except ImportError:
             raise ImportError("Twilio not installed. Run: pip install twilio")
         
         # Twilio credentials
@@ -73,93 +171,336 @@ class WhatsAppBot:
         
         self.workspace = workspace or Path.cwd()
         self.llm_model = llm_model
-        self.allowed_numbers = allowed_numbers or set()
+        # Normalized once so the per-request check is a plain set lookup
+        self.allowed_numbers = frozenset(normalize_number(n) for n in allowed_numbers or ())
+        
+        # Exponential backoff for outbound sends
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        
+        # Caps concurrent outbound sends during fan-out
+        self._send_slots = asyncio.Semaphore(send_concurrency)
+        
+        # Per-number token bucket: phone number -> (tokens, last refill time).
+        # The webhook runs on one event loop, so no lock is needed.
+        self.rate_capacity = rate_capacity
+        self.rate_per_sec = rate_per_sec
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+        
+        # Admission control for agent work: requests beyond the in-flight
+        # limit get a busy reply instead of queueing. The limit adapts AIMD
+        # style between 1 and max_inflight (see _adjust_inflight_limit).
+        self.max_inflight = max_inflight
+        self._inflight = 0
+        self._inflight_limit = max_inflight
+        
+        # Follow-up sends for replies that outlived their webhook
+        self._late_replies: Set[asyncio.Task] = set()
+        
+        # Authorization check chosen once: no restrictions, or set membership
+        self._auth_check: Callable[[str], bool] = (
+            (lambda _phone_number: True) if not self.allowed_numbers else self.allowed_numbers.__contains__
+        )
         
         # Twilio client
         self.client = Client(self.account_sid, self.auth_token)
         
-        # Agent per user phone number
-        self.agents: dict[str, AgentLoop] = {}
+        # Deferred so importing this module doesn't load the agent stack
+        from agent.loop import AgentLoop, AgentSession
+        
+        # One shared agent; each phone number only gets a lightweight session
+        self.agent = AgentLoop(
+            workspace=self.workspace,
+            llm_model=self.llm_model,
+        )
+        self._session_cls = AgentSession
         
-        # Flask app
-        self.app = Flask(__name__)
+        # The static system prompt is the same for every conversation, so its
+        # provider-side prompt cache is registered once and shared by all
+        # sessions. Changing the system prompt invalidates this cache.
+        from agent.context import get_system_prompt
+        self._system_prompt_cache_id = self.agent.llm.register_prefix(get_system_prompt())
+        
+        # phone number -> (session, last seen), least recently seen first
+        self.sessions: "OrderedDict[str, tuple[AgentSession, float]]" = OrderedDict()
+        
+        # Commands: lowercased message body -> handler returning TwiML
+        self._commands: dict[str, Callable[[str], str]] = {
+            "/start": self._start_command,
+            "/clear": self._clear_command,
+        }
+        
+        # Quart app
+        self.app = Quart(__name__)
         self._register_routes()
     
     def _register_routes(self) -> None:
-        """Register Flask routes."""
+        """Register Quart routes."""
+        from quart import request
         
         @self.app.route("/webhook", methods=["POST"])
-        def webhook():
+        async def webhook():
             """Handle incoming WhatsApp messages."""
             # Get message details
-            from_number = request.form.get("From", "")
-            message_body = request.form.get("Body", "").strip()
+            form = await request.form
+            from_number = form.get("From", "")
+            message_body = form.get("Body", "").strip()
             
             logger.info(f"Received from {from_number}: {message_body}")
             
-            # Create response
-            resp = MessagingResponse()
-            
             # Check authorization
-            if not self._is_authorized(from_number):
-                resp.message("X Unauthorized. Contact the administrator.")
-                return str(resp)
+            if not self._auth_check(from_number):
+                return UNAUTHORIZED_TWIML
+            
+            # Nothing to answer (e.g. media-only messages)
+            if not message_body:
+                return EMPTY_TWIML
             
             # Handle commands
-            if message_body.lower() == "/start":
-                welcome = (
-                    "welcome LinguaHome Smart Home Assistant\n\n"
-                    "I can help you control your smart home.\n\n"
-                    "Examples:\n"
-                    "- What's the temperature?\n"
-                    "- Turn off the entrance plug\n"
-                    "- Which room is warmest?\n\n"
-                    "Send /clear to reset conversation."
-                )
-                resp.message(welcome)
-                return str(resp)
+            cmd_key = message_body.lower()
+            command = self._commands.get(cmd_key)
+            if command:
+                return command(from_number)
             
-            if message_body.lower() == "/clear":
-                if from_number in self.agents:
-                    self.agents[from_number].reset_conversation()
-                resp.message("recycle Conversation cleared!")
-                return str(resp)
+            # Admission first, so a busy reply doesn't cost the sender a token
+            if self._inflight >= self._inflight_limit:
+                return BUSY_TWIML
+            
+            if not self._take_token(from_number):
+                return RATE_LIMITED_TWIML
             
             # Process with agent
             try:
-                agent = self._get_agent(from_number)
-                response = agent.process(message_body)
-                resp.message(response.message)
+                session = self._get_session(from_number)
+                self._inflight += 1
+                task = asyncio.ensure_future(self._run_agent(session, message_body))
+                response = await asyncio.wait_for(asyncio.shield(task), AGENT_TIMEOUT)
+                return _twiml(*split_message(response.message))
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                # The user turn is already in the conversation history, so the
+                # run is never cancelled; its reply follows as a message instead
+                logger.warning(f"Agent reply for {from_number} deferred")
+                self._send_later(from_number, task)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                return WORKING_TWIML
             except Exception as e:
                 logger.error(f"Error: {e}")
-                resp.message(f"X Error: {str(e)}")
-            
-            return str(resp)
+                return _twiml(f"X Error: {str(e)}")
         
         @self.app.route("/health", methods=["GET"])
-        def health():
+        async def health():
             """Health check endpoint."""
-            return {"status": "ok", "service": "LinguaHome WhatsApp Bot"}
-    
-    def _is_authorized(self, phone_number: str) -> bool:
-        """Check if phone number is authorized."""
-        if not self.allowed_numbers:
-            return True  # No restrictions
-        return phone_number in self.allowed_numbers
-    
-    def _get_agent(self, phone_number: str) -> AgentLoop:
-        """Get or create agent for user."""
-        if phone_number not in self.agents:
-            self.agents[phone_number] = AgentLoop(
-                workspace=self.workspace,
-                llm_model=self.llm_model,
-            )
-        return self.agents[phone_number]
+            return HEALTH_BODY, 200, _JSON_HEADERS
+    
+    def _start_command(self, phone_number: str) -> str:
+        """Handle /start command."""
+        return WELCOME_TWIML
+    
+    def _clear_command(self, phone_number: str) -> str:
+        """Handle /clear command."""
+        self.sessions.pop(phone_number, None)
+        return CLEAR_TWIML
+    
+    def _take_token(self, phone_number: str) -> bool:
+        """Take one request token from the number's bucket; False if empty."""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(phone_number, (self.rate_capacity, now))
+        tokens = min(self.rate_capacity, tokens + (now - last) * self.rate_per_sec)
+        allowed = tokens >= 1
+        self._buckets[phone_number] = (tokens - 1 if allowed else tokens, now)
+        self._buckets.move_to_end(phone_number)
+        
+        # Least recently seen numbers first; they have refilled the longest
+        while len(self._buckets) > MAX_CONVERSATIONS:
+            self._buckets.popitem(last=False)
+        return allowed
+    
+    async def _run_agent(self, session: "AgentSession", message_body: str):
+        """Run one agent turn already counted in _inflight, and feed its outcome to AIMD."""
+        try:
+            response = await session.process_async(message_body)
+        except Exception:
+            self._adjust_inflight_limit(failed=True)
+            raise
+        finally:
+            self._inflight -= 1
+        # Failed code runs are the model's mistakes; only failed LLM calls carry no code
+        self._adjust_inflight_limit(failed=not response.success and not response.code_generated)
+        return response
+    
+    def _send_later(self, to: str, task: asyncio.Task) -> None:
+        """Send a still-running agent turn's reply once it is ready."""
+        follow_up = asyncio.ensure_future(self._send_late_reply(to, task))
+        self._late_replies.add(follow_up)
+        follow_up.add_done_callback(self._late_replies.discard)
+    
+    async def _send_late_reply(self, to: str, task: asyncio.Task) -> None:
+        """Wait for an agent turn and send its reply as messages, in order."""
+        try:
+            text = (await task).message
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            text = f"X Error: {str(e)}"
+        for chunk in split_message(text):
+            await self.send_message(to, chunk)
+    
+    def _adjust_inflight_limit(self, failed: bool) -> None:
+        """
+        Halve the in-flight limit after a failed agent run, grow it by one otherwise.
+        
+        Failures (LLM timeouts, LLM and transport errors) signal overload;
+        failed code runs and slow but successful runs do not shrink the limit.
+        """
+        if failed:
+            self._inflight_limit = max(1, self._inflight_limit // 2)
+        elif self._inflight_limit < self.max_inflight:
+            self._inflight_limit += 1
+    
+    def _get_session(self, phone_number: str) -> "AgentSession":
+        """Get or create the conversation session for user."""
+        now = time.monotonic()
+        if CONVERSATION_TTL > 0:
+            self._evict_idle(now)
+        
+        entry = self.sessions.get(phone_number)
+        if entry is not None:
+            self.sessions.move_to_end(phone_number)
+            session = entry[0]
+        else:
+            session = self._session_cls(self.agent, phone_number)
+            if len(self.sessions) >= MAX_CONVERSATIONS:
+                self.sessions.popitem(last=False)
+        
+        self.sessions[phone_number] = (session, now)
+        return session
+    
+    def _evict_idle(self, now: float) -> None:
+        """Drop conversations idle for longer than CONVERSATION_TTL."""
+        # Least recently seen first, so stop at the first fresh one
+        while self.sessions:
+            _, last_seen = next(iter(self.sessions.values()))
+            if now - last_seen < CONVERSATION_TTL:
+                break
+            self.sessions.popitem(last=False)
+    
+    async def send_message(self, to: str, body: str) -> bool:
+        """
+        Send a WhatsApp message outside a webhook reply.
+        
+        Rate-limited (429) and transient 5xx errors are retried with
+        exponential backoff and jitter.
+        
+        Returns:
+            True if Twilio accepted the message
+        """
+        from twilio.base.exceptions import TwilioRestException
+        
+        for attempt in range(self.max_retries + 1):
+            try:
+                # The Twilio client is synchronous; keep it off the event loop
+                await asyncio.to_thread(
+                    self.client.messages.create,
+                    from_=self.whatsapp_number,
+                    to=to,
+                    body=body,
+                )
+                return True
+            except TwilioRestException as e:
+                if e.status not in RETRYABLE_STATUSES or attempt == self.max_retries:
+                    logger.error(f"Failed to send message to {to}: {e}")
+                    return False
+                
+                delay = min(self.retry_cap, self.retry_base * 2 ** attempt)
+                delay += random.uniform(0, self.retry_base)
+                
+                logger.warning(f"Twilio returned {e.status}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"Failed to send message to {to}: {e}")
+                return False
+        return False
+    
+    async def send_messages(self, messages: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Send several (to, body) messages concurrently.
+        
+        At most `send_concurrency` sends are in flight at once; each one
+        retries on its own like send_message.
+        
+        Returns:
+            One success flag per message, in order
+        """
+        async def send(to: str, body: str) -> bool:
+            async with self._send_slots:
+                return await self.send_message(to, body)
+        
+        return list(await asyncio.gather(*(send(to, body) for to, body in messages)))
     
     def run(self, host: str = "0.0.0.0", port: int = 5000, debug: bool = False) -> None:
-        """Run the Flask server."""
+        """
+        Run the Quart app on the Hypercorn ASGI server (one process).
+        
+        For several worker processes serve create_app() instead, e.g.
+        gunicorn --preload -k uvicorn.workers.UvicornWorker -w 4 'channels.whatsapp_bot:create_app()'
+        """
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+        
         logger.info(f"Starting LinguaHome WhatsApp Bot on {host}:{port}")
-        self.app.run(host=host, port=port, debug=debug)
+        config = Config()
+        config.bind = [f"{host}:{port}"]
+        config.use_reloader = debug
+        asyncio.run(serve(self.app, config))
+
+
+def _bot_from_env() -> WhatsAppBot:
+    """Build a WhatsAppBot configured from environment variables."""
+    # Parse allowed numbers
+    allowed_str = os.environ.get("WHATSAPP_ALLOWED_NUMBERS", "")
+    allowed_numbers = set()
+    if allowed_str:
+        allowed_numbers = {num for num in allowed_str.split(",") if num.strip()}
+    
+    return WhatsAppBot(
+        workspace=Path(__file__).parent.parent,
+        llm_model=os.environ.get("LINGUAHOME_MODEL", "gpt-4o"),
+        allowed_numbers=allowed_numbers,
+    )
+
+
+class _WorkerApp:
+    """ASGI app that builds the bot on its first event, i.e. in each worker."""
+    
+    def __init__(self):
+        self._app = None
+    
+    async def __call__(self, scope, receive, send):
+        if self._app is None:
+            self._app = _bot_from_env().app
+        await self._app(scope, receive, send)
+
+
+def create_app():
+    """
+    ASGI app factory for production servers.
+    
+    Read-only data (system prompt, device table, sensor modules) is loaded
+    here, so with --preload it is built once in the master and shared
+    copy-on-write by the forked workers. The bot itself holds a process
+    pool and HTTP clients, which don't survive a fork, so each worker
+    builds its own on startup.
+    
+    Usage:
+        gunicorn --preload -k uvicorn.workers.UvicornWorker -w 4 'channels.whatsapp_bot:create_app()'
+    """
+    from agent.context import get_system_prompt
+    from agent.code_executor import preload
+    
+    get_system_prompt()
+    preload()
+    return _WorkerApp()
 
 
 def main():
@@ -175,26 +516,18 @@ def main():
         print("  TWILIO_AUTH_TOKEN      - Your Twilio Auth Token")
         print("  TWILIO_WHATSAPP_NUMBER - Twilio WhatsApp number (e.g., whatsapp:+14155238886)")
         print("\nOptional:")
-        print("  WHATSAPP_ALLOWED_NUMBERS - Comma-separated allowed phone numbers")
+        print("  WHATSAPP_ALLOWED_NUMBERS - Comma-separated allowed phone numbers (e.g., +14155551234)")
         print("  LINGUAHOME_MODEL         - LLM model to use (default: gpt-4o)")
         print("  PORT                     - Server port (default: 5000)")
+        print("  WHATSAPP_MAX_CONVERSATIONS - Conversations kept in memory (default: 1000)")
+        print("  WHATSAPP_CONVERSATION_TTL  - Drop conversations idle this many seconds (default: off)")
+        print("  WHATSAPP_AGENT_TIMEOUT     - Seconds before a slow reply is acknowledged and sent as a follow-up message (default: 14)")
         return
     
-    # Parse allowed numbers
-    allowed_str = os.environ.get("WHATSAPP_ALLOWED_NUMBERS", "")
-    allowed_numbers = set()
-    if allowed_str:
-        allowed_numbers = {num.strip() for num in allowed_str.split(",")}
-    
-    workspace = Path(__file__).parent.parent
     model = os.environ.get("LINGUAHOME_MODEL", "gpt-4o")
     port = int(os.environ.get("PORT", "5000"))
     
-    bot = WhatsAppBot(
-        workspace=workspace,
-        llm_model=model,
-        allowed_numbers=allowed_numbers,
-    )
+    bot = _bot_from_env()
     
     print(f"robot LinguaHome WhatsApp Bot")
     print(f"Model: {model}")
@@ -83,5 +83,13 @@ DEVICE_MAP = {
 # Room list
 ROOMS = ["Working area", "Robot Corner", "Kaspar Room", "Entrance", "Observation Room"]
 
+# Device names grouped by room and by type, built once at import
+DEVICES_BY_ROOM: dict[str, list[str]] = {room: [] for room in ROOMS}
+DEVICES_BY_TYPE: dict[str, list[str]] = {}
+for _name, _info in DEVICE_MAP.items():
+    DEVICES_BY_ROOM.setdefault(_info["room"], []).append(_name)
+    DEVICES_BY_TYPE.setdefault(_info["type"], []).append(_name)
+del _name, _info
+
 # Controllable devices
-CONTROLLABLE_DEVICES = {k: v for k, v in DEVICE_MAP.items() if v["type"] == "plug"}
+CONTROLLABLE_DEVICES = {name: DEVICE_MAP[name] for name in DEVICES_BY_TYPE["plug"]}
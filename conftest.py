@@ -0,0 +1,39 @@
+"""
+Root pytest configuration.
+
+Runs before any project module is imported by the tests.
+"""
+
+import os
+import shutil
+import tempfile
+import importlib
+
+import pytest
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # Keep any Numba-compiled code in the interpreter while testing, so imports
+    # don't pay JIT compile time the tests never benefit from. Benchmark runs
+    # (--codspeed) keep the JIT, so they measure the compiled kernels.
+    if not config.getoption("codspeed", default=False):
+        os.environ.setdefault("NUMBA_DISABLE_JIT", "1")
+    
+    # Keep test workspaces on tmpfs when available, so memory log writes
+    # don't hit the disk (an explicit --basetemp still wins). The directory
+    # is private to this session; xdist workers get subdirectories of it.
+    if config.option.basetemp is None and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        config._shm_basetemp = config.option.basetemp = tempfile.mkdtemp(prefix="pytest-", dir="/dev/shm")
+
+
+def pytest_unconfigure(config):
+    # tmpfs is memory, so the session's directory is not left behind
+    basetemp = getattr(config, "_shm_basetemp", None)
+    if basetemp is not None:
+        shutil.rmtree(basetemp, ignore_errors=True)
+
+
+def pytest_sessionstart(session):
+    # Start from fresh import finder caches, so import-bound tests like
+    # test_imports measure the same cold path on every run
+    importlib.invalidate_caches()
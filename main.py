@@ -6,7 +6,6 @@ Main entry point for CLI and testing.
 """
 
 import os
-import sys
 import argparse
 from pathlib import Path
 
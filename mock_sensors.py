@@ -4,10 +4,18 @@ LinguaHome Mock Sensors
 Mock implementations for testing without database/hardware.
 """
 
+import sys
 import random
 from datetime import datetime
 from typing import Dict, List, Optional
 
+# NumPy for vectorized aggregations (optional)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 # Mock sensor data
 MOCK_SENSORS = {
     1025: {"sensorId": 1025, "name": "plug_0", "value": "95.3", "status": "On", "locationName": "Working area", "sensorTypeName": "Power"},
@@ -35,6 +43,72 @@ MOCK_SENSORS = {
     1055: {"sensorId": 1055, "name": "door_4", "value": "1", "status": "Open", "locationName": "Observation Room", "sensorTypeName": "Door"},
 }
 
+# Share one string object per room/type name across all sensors
+for _sensor in MOCK_SENSORS.values():
+    _sensor["locationName"] = sys.intern(_sensor["locationName"])
+    _sensor["sensorTypeName"] = sys.intern(_sensor["sensorTypeName"])
+    _sensor["status"] = sys.intern(_sensor["status"])
+del _sensor
+
+# Struct-of-arrays view of MOCK_SENSORS: position i describes SENSOR_IDS[i].
+# Rooms and types are stored as indexes into ROOM_NAMES / TYPE_NAMES.
+ROOM_NAMES = list(dict.fromkeys(s["locationName"] for s in MOCK_SENSORS.values()))
+ROOM_TO_IDX = {room: i for i, room in enumerate(ROOM_NAMES)}
+TYPE_NAMES = list(dict.fromkeys(s["sensorTypeName"] for s in MOCK_SENSORS.values()))
+TYPE_TO_IDX = {sensor_type: i for i, sensor_type in enumerate(TYPE_NAMES)}
+
+SENSOR_IDS = list(MOCK_SENSORS)
+SENSOR_ROOM_IDX = [ROOM_TO_IDX[s["locationName"]] for s in MOCK_SENSORS.values()]
+SENSOR_TYPE_IDX = [TYPE_TO_IDX[s["sensorTypeName"]] for s in MOCK_SENSORS.values()]
+SENSOR_VALUES = [float(s["value"]) for s in MOCK_SENSORS.values()]
+
+if NUMPY_AVAILABLE:
+    SENSOR_IDS = np.array(SENSOR_IDS, dtype=np.int64)
+    SENSOR_ROOM_IDX = np.array(SENSOR_ROOM_IDX, dtype=np.int8)
+    SENSOR_TYPE_IDX = np.array(SENSOR_TYPE_IDX, dtype=np.int8)
+    SENSOR_VALUES = np.array(SENSOR_VALUES, dtype=np.float32)
+
+
+# Baseline temperatures that MockSensors varies per instance
+_BASE_TEMPS = {
+    sid: float(sensor["value"])
+    for sid, sensor in MOCK_SENSORS.items()
+    if "temperature" in sensor["name"]
+}
+
+
+def sensors_in_room(room: str):
+    """Sensor IDs in a room (a numpy array when numpy is available)."""
+    idx = ROOM_TO_IDX.get(room, -1)
+    if NUMPY_AVAILABLE:
+        return SENSOR_IDS[SENSOR_ROOM_IDX == idx]
+    return [sid for sid, r in zip(SENSOR_IDS, SENSOR_ROOM_IDX) if r == idx]
+
+
+def hottest_room(values=None) -> Optional[str]:
+    """
+    Room with the highest temperature reading.
+    
+    Reads SENSOR_VALUES, or `values` in the same sensor order. Like
+    sensors_in_room, this is a local aggregation over the columns above,
+    not part of the Sensors API that generated code sees.
+    """
+    if values is None:
+        values = SENSOR_VALUES
+    temp = TYPE_TO_IDX.get("Temperature", -1)
+    if NUMPY_AVAILABLE:
+        candidates = np.flatnonzero(SENSOR_TYPE_IDX == temp)
+        if not len(candidates):
+            return None
+        best = candidates[np.asarray(values)[candidates].argmax()]
+    else:
+        candidates = [i for i, t in enumerate(SENSOR_TYPE_IDX) if t == temp]
+        if not candidates:
+            return None
+        best = max(candidates, key=values.__getitem__)
+    return ROOM_NAMES[SENSOR_ROOM_IDX[best]]
+
+
 # Plug states
 PLUG_STATES = {
     25: True,   # plug_0 - On
@@ -49,17 +123,41 @@ class MockSensors:
     """Mock sensor data access class."""
     
     def __init__(self):
+        # Shared baseline; only the temperature sensors get fresh per-instance
+        # dicts, so the variation never leaks into MOCK_SENSORS
         self._sensors = dict(MOCK_SENSORS)
-        # Add small random variations
-        for sid, sensor in self._sensors.items():
-            if 'temperature' in sensor['name']:
-                base_temp = float(sensor['value'])
-                variation = random.uniform(-0.5, 0.5)
-                self._sensors[sid]['value'] = f"{base_temp + variation:.1f}"
+        for sid, base_temp in _BASE_TEMPS.items():
+            value = round(base_temp + random.uniform(-0.5, 0.5), 1)
+            self._sensors[sid] = {**MOCK_SENSORS[sid], 'value': f"{value:.1f}"}
+        
+        # Name index so lookups by name don't scan every sensor
+        self._by_name = {sensor['name']: sensor for sensor in self._sensors.values()}
+        
+        # Precomputed findSensors() results per type, room and (type, room)
+        self._all = list(self._sensors.values())
+        self._by_type: Dict[str, List[Dict]] = {}
+        self._by_room: Dict[str, List[Dict]] = {}
+        self._by_type_room: Dict[tuple, List[Dict]] = {}
+        for sensor in self._all:
+            sensor_type, room = sensor['sensorTypeName'], sensor['locationName']
+            self._by_type.setdefault(sensor_type, []).append(sensor)
+            self._by_room.setdefault(room, []).append(sensor)
+            self._by_type_room.setdefault((sensor_type, room), []).append(sensor)
     
-    def findSensors(self) -> List[Dict]:
-        """Get all sensors."""
-        return list(self._sensors.values())
+    def findSensors(self, *, type: Optional[str] = None, room: Optional[str] = None) -> List[Dict]:
+        """
+        Get all sensors, or only those of a sensor type and/or in a room.
+        
+        The filters are optional keywords for local callers; the real
+        Sensors API has no such parameters, so findSensors() with no
+        arguments behaves the same on both. Returns a precomputed list
+        shared between calls; don't modify it.
+        """
+        if type is None:
+            return self._all if room is None else self._by_room.get(room, [])
+        if room is None:
+            return self._by_type.get(type, [])
+        return self._by_type_room.get((type, room), [])
     
     def getSensor(self, sensor_id: int) -> Optional[Dict]:
         """Get a single sensor by ID."""
@@ -67,10 +165,33 @@ class MockSensors:
     
     def getSensorByName(self, name: str) -> Optional[Dict]:
         """Get sensor by name."""
-        for sensor in self._sensors.values():
-            if sensor['name'] == name:
-                return sensor
-        return None
+        return self._by_name.get(name)
+
+
+class _ReadOnlyDict(dict):
+    """A dict that refuses changes, so one instance can be handed to every caller."""
+    
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("actuator results are read-only")
+    
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    
+    def __reduce__(self):
+        # Copies and pickles are rebuilt from the contents, not item by item
+        return type(self), (dict(self),)
+
+
+# Prebuilt actuator results, shared by every setValue call; still plain dicts
+# to generated code (printing, json.dumps), but read-only
+_RESULT_ON = _ReadOnlyDict(success=True, state="On")
+_RESULT_OFF = _ReadOnlyDict(success=True, state="Off")
+
+# Action -> (new plug state, result)
+_ACTIONS = {
+    "turnOn": (True, _RESULT_ON),
+    "turnOff": (False, _RESULT_OFF),
+}
 
 
 class MockZWaveHomeActuator:
@@ -84,14 +205,12 @@ class MockZWaveHomeActuator:
         if device_id not in self._states:
             return {"success": False, "error": f"Device {device_id} not found"}
         
-        if action == "turnOn":
-            self._states[device_id] = True
-            return {"success": True, "state": "On"}
-        elif action == "turnOff":
-            self._states[device_id] = False
-            return {"success": True, "state": "Off"}
-        else:
+        entry = _ACTIONS.get(action)
+        if entry is None:
             return {"success": False, "error": f"Unknown action: {action}"}
+        
+        self._states[device_id], result = entry
+        return result
     
     def getState(self, device_id: int) -> Optional[bool]:
         """Get device state."""